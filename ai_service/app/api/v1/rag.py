@@ -1,15 +1,21 @@
+import asyncio
+import json
+import time
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from langchain.chains.summarize.map_reduce_prompt import prompt_template
 
 from app.core.config import settings
+from app.core.metrics import record_token_usage
 from app.schemas.ai_reply import AIReply
-from app.schemas.rag_schema import SearchRequest
-from app.services.mongodb_service import mongodb_service
-from app.services.llm_service import rag_pipeline
-from app.core.prompt import RAG_PROMPT_TEMPLATE
-
-prompt_template = RAG_PROMPT_TEMPLATE
-
+from app.schemas.rag_schema import BatchSearchRequest, SearchRequest
+from app.services.mongodb_service import reply_writer
+from app.services.llm_service import build_completion, rag_pipeline
+from app.services.pipeline_trace import PipelineTrace
+from app.services.prompt_template_cache import prompt_templates
+from app.services.semantic_cache import semantic_cache
+from app.services.tenant_prompt_service import embed_queries, search_vectors_by_embeddings
 input_token_price = settings.INPUT_TOKEN_PRICE
 output_token_price = settings.OUTPUT_TOKEN_PRICE
 
@@ -20,12 +26,87 @@ async def generate_answer(request: SearchRequest):
     query = request.query
     tenant_id = request.tenant_id
     try:
-        response = rag_pipeline(query, tenant_id, prompt_template, "","")
+        trace = PipelineTrace()
+        prompt_template = await prompt_templates.get(tenant_id)
+        response = await rag_pipeline(query, tenant_id, prompt_template, "","", trace=trace)
+        if isinstance(response, str):
+            response = build_completion(response, None)
 
         ai_reply = AIReply.from_openai_completion("ADMIN", query, response, tenant_id, input_token_price, output_token_price)
+        trace.apply(ai_reply)
 
-        await mongodb_service.ensure_index(tenant_id)
-        await mongodb_service.save_ai_reply(ai_reply)
+        reply_writer.add(ai_reply)
+        record_token_usage(ai_reply)
         return {"data": response.choices[0].message.content}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/batch")
+async def generate_answers(request: BatchSearchRequest):
+    """
+    Runs a whole question set against a tenant's knowledge base.
+
+    All queries are embedded in one embeddings call and searched with one multi-vector Milvus
+    request; completions then run concurrently (at most RAG_BATCH_CONCURRENCY at a time) and
+    each result is streamed back as an NDJSON line with its latency and token counts.
+    Handovers the model asks for are only reported, never dispatched. With dry_run, no AIReply
+    usage documents are written and no answers are stored in the semantic cache.
+    """
+    tenant_id = request.tenant_id
+    started = time.perf_counter()
+    # Read before retrieval, so answers built on documents that change meanwhile are not cached
+    cache_generation = semantic_cache.generation(tenant_id)
+    try:
+        embeddings = await embed_queries(request.queries, tenant_id)
+        relevant_docs = await search_vectors_by_embeddings(embeddings, tenant_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    retrieval_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    prompt_template = await prompt_templates.get(tenant_id)
+    semaphore = asyncio.Semaphore(settings.RAG_BATCH_CONCURRENCY)
+
+    async def answer(index: int, query: str, embedding: list, docs: list) -> dict:
+        result = {"index": index, "query": query}
+        trace = PipelineTrace()
+        try:
+            async with semaphore:
+                response = await rag_pipeline(query, tenant_id, prompt_template, "", "", trace=trace,
+                                              query_embedding=embedding, relevant_docs=docs, allow_handover=False,
+                                              cache_answers=not request.dry_run,
+                                              cache_generation=cache_generation)
+            if isinstance(response, str):
+                response = build_completion(response, None)
+
+            ai_reply = AIReply.from_openai_completion("ADMIN", query, response, tenant_id, input_token_price, output_token_price)
+            trace.apply(ai_reply)
+            if not request.dry_run:
+                reply_writer.add(ai_reply)
+            record_token_usage(ai_reply)
+
+            result.update(
+                data=ai_reply.ai_reply,
+                latency_ms=trace.stage_timings.get("total"),
+                input_tokens=ai_reply.tokens["input"].count,
+                output_tokens=ai_reply.tokens["output"].count,
+                cache_hit=trace.cache_hit,
+                handover=trace.handover,
+                documents=len(docs)
+            )
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    async def stream():
+        yield json.dumps({"queries": len(request.queries), "retrieval_ms": retrieval_ms}) + "\n"
+        tasks = [asyncio.create_task(answer(index, query, embedding, docs))
+                 for index, (query, embedding, docs) in enumerate(zip(request.queries, embeddings, relevant_docs))]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
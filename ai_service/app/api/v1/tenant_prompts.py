@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.services.tenant_prompt_service import create_template, get_templates, get_template_by_id
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.tenant_prompt_service import create_template, get_templates, get_template_by_id, update_template
 from app.schemas.tenant_prompt_schema import TenantPromptTemplate, TenantPromptTemplateCreate
 from app.core.database import get_db
 from typing import List
@@ -8,22 +8,32 @@ from typing import List
 router = APIRouter()
 
 @router.post("/", response_model=TenantPromptTemplate)
-def store_template(data: TenantPromptTemplateCreate, db: Session = Depends(get_db)):
+async def store_template(data: TenantPromptTemplateCreate, db: AsyncSession = Depends(get_db)):
     try:
-        return create_template(db, data)
+        return await create_template(db, data)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/", response_model=List[TenantPromptTemplate])
-def read_templates(tenant_id: str = None, db: Session = Depends(get_db)):
+async def read_templates(tenant_id: str = None, db: AsyncSession = Depends(get_db)):
     try:
-        return get_templates(db, tenant_id)
+        return await get_templates(db, tenant_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{template_id}", response_model=TenantPromptTemplate)
-def get_template(template_id: str, db: Session = Depends(get_db)):
-    template = get_template_by_id(db, template_id)
+async def get_template(template_id: int, db: AsyncSession = Depends(get_db)):
+    template = await get_template_by_id(db, template_id)
     if template is None:
         raise HTTPException(status_code=404, detail="Template not found")
-    return template
\ No newline at end of file
+    return template
+
+@router.put("/{template_id}", response_model=TenantPromptTemplate)
+async def replace_template(template_id: int, data: TenantPromptTemplateCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        template = await update_template(db, template_id, data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import openai
+
+from app.core.config import settings
+from app.core.metrics import LLM_BASELINE_RTT, LLM_CONCURRENCY_LIMIT, LLM_IN_FLIGHT, LLM_OBSERVED_RTT
+
+logger = logging.getLogger(__name__)
+
+
+def is_openai_overload(exc: BaseException) -> bool:
+    """
+    Errors that mean the API is saturated: rate limits, timeouts, dropped connections and 5xx.
+    """
+    if isinstance(exc, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                        asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+class LimiterSlot:
+    """
+    A held unit of concurrency. By default the limiter samples the latency of the whole call;
+    streaming callers call first_response() to sample the time to the first token instead.
+    """
+
+    def __init__(self, limiter: "AdaptiveConcurrencyLimiter"):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.sampled = False
+
+    def first_response(self):
+        if not self.sampled:
+            self.sampled = True
+            self.limiter._on_sample(time.monotonic() - self.started)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent calls to a remote API.
+
+    Latency is tracked as a short EWMA (recent RTT) against a long EWMA (baseline RTT). While the
+    recent RTT stays within latency_tolerance times the baseline and the limit is actually in use,
+    it grows by about one per limit's worth of completed calls. When the RTT rises it is multiplied
+    by backoff_ratio, and an overload error (see is_openai_overload) multiplies it by
+    overload_ratio. Decreases are applied at most once per recent RTT, so one slow burst counts as
+    one signal. Callers over the limit wait in FIFO order.
+    """
+
+    def __init__(self, operation: str, initial_limit: int, min_limit: int, max_limit: int,
+                 latency_tolerance: float = 2.0, backoff_ratio: float = 0.9, overload_ratio: float = 0.5,
+                 is_overload: Callable[[BaseException], bool] = is_openai_overload):
+        self.operation = operation
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.overload_ratio = overload_ratio
+        self.is_overload = is_overload
+        self.in_flight = 0
+        self.rtt: Optional[float] = None
+        self.baseline_rtt: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one unit of concurrency around a call and feeds its latency or failure back into the
+        limit. Yields a LimiterSlot.
+        """
+        await self._acquire()
+        slot = LimiterSlot(self)
+        try:
+            yield slot
+        except BaseException as e:
+            if self.is_overload(e):
+                self._decrease(self.overload_ratio, type(e).__name__)
+            raise
+        else:
+            slot.first_response()
+        finally:
+            self._release()
+
+    async def _acquire(self):
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._publish()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Granted a slot just before being cancelled: hand it back
+            if not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+        self._publish()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _on_sample(self, rtt: float):
+        if self.rtt is None:
+            self.rtt = self.baseline_rtt = rtt
+        else:
+            self.rtt += 0.2 * (rtt - self.rtt)
+            self.baseline_rtt += 0.02 * (rtt - self.baseline_rtt)
+
+        if self.rtt > self.baseline_rtt * self.latency_tolerance:
+            self._decrease(self.backoff_ratio, f"RTT {self.rtt:.2f}s over baseline {self.baseline_rtt:.2f}s")
+        elif self.in_flight >= self.limit / 2:
+            # Only grow a limit that is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._publish()
+
+    def _decrease(self, ratio: float, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < (self.rtt or 0):
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * ratio)
+        if int(self.limit) < int(previous):
+            logger.info(f"{self.operation} concurrency limit lowered to {int(self.limit)} ({reason})")
+        self._publish()
+
+    def _publish(self):
+        LLM_CONCURRENCY_LIMIT.labels(operation=self.operation).set(int(self.limit))
+        LLM_IN_FLIGHT.labels(operation=self.operation).set(self.in_flight)
+        if self.rtt is not None:
+            LLM_OBSERVED_RTT.labels(operation=self.operation).set(self.rtt)
+            LLM_BASELINE_RTT.labels(operation=self.operation).set(self.baseline_rtt)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rtt_seconds": self.rtt,
+            "baseline_rtt_seconds": self.baseline_rtt,
+        }
+
+
+class ChatLimiters:
+    """
+    One adaptive limiter per chat operation (rag, summary, ...) and completion backend, created
+    on first use. Operations have very different latencies, so sharing a limiter would read a
+    burst of long summaries as congestion and throttle customer replies; likewise a slow fallback
+    tier must not shrink the primary's limit.
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int, max_limit: int, latency_tolerance: float):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self._limiters: Dict[Tuple[str, str], AdaptiveConcurrencyLimiter] = {}
+
+    def get(self, operation: str, backend: str) -> AdaptiveConcurrencyLimiter:
+        limiter = self._limiters.get((operation, backend))
+        if limiter is None:
+            limiter = self._limiters[(operation, backend)] = AdaptiveConcurrencyLimiter(
+                f"{operation}:{backend}",
+                initial_limit=self.initial_limit,
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                latency_tolerance=self.latency_tolerance
+            )
+        return limiter
+
+    def stats(self) -> dict:
+        return {limiter.operation: limiter.stats() for limiter in self._limiters.values()}
+
+
+chat_limiters = ChatLimiters(
+    initial_limit=settings.LLM_CONCURRENCY_INITIAL_LIMIT,
+    min_limit=settings.LLM_CONCURRENCY_MIN_LIMIT,
+    max_limit=settings.LLM_CONCURRENCY_MAX_LIMIT,
+    latency_tolerance=settings.LLM_LATENCY_TOLERANCE
+)
+embedding_limiter = AdaptiveConcurrencyLimiter(
+    "embeddings",
+    initial_limit=settings.LLM_CONCURRENCY_INITIAL_LIMIT,
+    min_limit=settings.LLM_CONCURRENCY_MIN_LIMIT,
+    max_limit=settings.LLM_CONCURRENCY_MAX_LIMIT,
+    latency_tolerance=settings.LLM_LATENCY_TOLERANCE
+)
@@ -0,0 +1,20 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+
+# Bounded pool for the blocking client libraries we still depend on (pymilvus, langid, ...)
+# so they never run on the event loop thread.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=settings.BLOCKING_EXECUTOR_WORKERS,
+    thread_name_prefix="blocking-io"
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking callable on the shared bounded executor and awaits its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
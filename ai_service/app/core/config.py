@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -12,10 +12,103 @@ class Settings(BaseSettings):
     INPUT_TOKEN_PRICE: float = 0.000150 / 1000
     OUTPUT_TOKEN_PRICE: float = 0.000600 / 1000
 
-    
+    # Chat completion backends, tried in order by rag_pipeline before handing over to a human.
+    # Each tier: name, model (default CHAT_COMPLETION_MODEL), timeout in seconds (default
+    # COMPLETION_TIMEOUT_SECONDS), and optionally base_url/api_key for an OpenAI-compatible
+    # endpoint such as a local stand-in model, and max_retries (default: the SDK's). Streamed
+    # replies apply the timeout to the first chunk and to each gap between chunks.
+    # The first tier also serves summaries, which run under SUMMARY_COMPLETION_TIMEOUT_SECONDS.
+    COMPLETION_TIMEOUT_SECONDS: float = 30.0
+    COMPLETION_BACKENDS: List[Dict[str, Any]] = [
+        {"name": "primary", "timeout": 20},
+        {"name": "fallback", "model": "gpt-3.5-turbo", "timeout": 10},
+    ]
+    SUMMARY_COMPLETION_TIMEOUT_SECONDS: float = 120.0
+
+    # Token-per-minute budget for OpenAI calls, kept in Redis and shared with tenant_service:
+    # one bucket for the whole key and one per tenant. Completions without max_tokens are
+    # estimated at TOKEN_BUDGET_COMPLETION_ESTIMATE output tokens until their usage is known.
+    TOKEN_BUDGET_ENABLED: bool = True
+    TOKEN_BUDGET_TOKENS_PER_MINUTE: int = 2_000_000
+    TOKEN_BUDGET_TENANT_TOKENS_PER_MINUTE: int = 400_000
+    TOKEN_BUDGET_COMPLETION_ESTIMATE: int = 512
+    TOKEN_BUDGET_KEY_PREFIX: str = "openai:token_budget"
+
+    # Adaptive (AIMD) limit on concurrent chat completion and embedding calls, per process:
+    # grows while latency stays within LLM_LATENCY_TOLERANCE x its baseline, shrinks on rising
+    # latency and on 429/5xx/timeouts
+    LLM_CONCURRENCY_INITIAL_LIMIT: int = 16
+    LLM_CONCURRENCY_MIN_LIMIT: int = 2
+    LLM_CONCURRENCY_MAX_LIMIT: int = 256
+    LLM_LATENCY_TOLERANCE: float = 2.0
+
+    # Hedge non-streamed RAG completions: after HEDGE_LATENCY_PERCENTILE of the last
+    # HEDGE_LATENCY_WINDOW completion latencies, send a second identical request and keep
+    # whichever answers first. Hedges cost at most HEDGE_TENANT_TOKENS_PER_MINUTE extra per tenant.
+    HEDGE_COMPLETIONS: bool = False
+    HEDGE_LATENCY_PERCENTILE: float = 95.0
+    HEDGE_MIN_SAMPLES: int = 50
+    HEDGE_LATENCY_WINDOW: int = 500
+    HEDGE_TENANT_TOKENS_PER_MINUTE: int = 20000
+
+    # Stream replies to the customer as CHAT_CHUNK messages followed by a CHAT_END
+    STREAM_REPLIES: bool = False
+    # Buffer deltas until at least this many characters before publishing a chunk
+    STREAM_CHUNK_MIN_CHARS: int = 16
+
+    # Semantic answer cache in front of the RAG pipeline
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT: int = 500
+
+    # Query embedding cache (in-process LRU + Redis); vectors packed as float32 or float16
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 10000
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    EMBEDDING_CACHE_DTYPE: str = "float32"
+
+    # Coalesce concurrent embedding requests into one API call
+    EMBEDDING_BATCH_MAX_INPUTS: int = 64
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+
+    # Summaries are updated incrementally from the previous summary plus the messages after it
+    SUMMARY_INCREMENTAL: bool = True
+    SUMMARY_STATE_TTL_SECONDS: int = 7 * 24 * 3600
+    # POST /summary/batch: most customers per request, and summaries run at once
+    SUMMARY_BATCH_MAX_ITEMS: int = 100
+    SUMMARY_BATCH_CONCURRENCY: int = 8
+    # Histories above this many tokens are summarized map-reduce style: segments of
+    # SUMMARY_SEGMENT_TOKENS summarized in parallel, then the partial summaries combined
+    SUMMARY_MAP_REDUCE_THRESHOLD_TOKENS: int = 6000
+    SUMMARY_SEGMENT_TOKENS: int = 3000
+    SUMMARY_MAP_CONCURRENCY: int = 4
+
+    # POST /api/v1/rag/batch: most queries per request, and completions run at once
+    RAG_BATCH_MAX_QUERIES: int = 100
+    RAG_BATCH_CONCURRENCY: int = 8
+
+    # Worker threads for blocking calls (Milvus search, language detection)
+    BLOCKING_EXECUTOR_WORKERS: int = int(os.getenv("BLOCKING_EXECUTOR_WORKERS", "16"))
+
+    # Handover: published to HANDOVER_QUEUE on the broker; the HTTP API is the fallback path
+    HANDOVER_QUEUE: str = "handover_requests"
+    HANDOVER_PUBLISH_TIMEOUT_SECONDS: float = 2.0
+    HANDOVER_ENDPOINT: str = os.getenv("HANDOVER_ENDPOINT", "https://flashresponse.net/chat/api/v1/chats/handover")
+    HANDOVER_TIMEOUT_SECONDS: float = 5.0
+    HANDOVER_HTTP_MAX_CONNECTIONS: int = 20
+    HANDOVER_HTTP_RETRIES: int = 3
+    HANDOVER_BACKOFF_BASE_SECONDS: float = 0.25
+    HANDOVER_BACKOFF_MAX_SECONDS: float = 2.0
+    HANDOVER_BREAKER_FAILURE_THRESHOLD: int = 5
+    HANDOVER_BREAKER_RESET_SECONDS: float = 30.0
+
     # Milvus Database Configuration
     MILVUS_HOST: str = os.getenv("MILVUS_HOST", "localhost")
     MILVUS_PORT: int = os.getenv("MILVUS_PORT", 19530)
+    # Cached collection handles: drop after this long unused, re-check schema/index this often
+    MILVUS_HANDLE_IDLE_SECONDS: int = 1800
+    MILVUS_HANDLE_REFRESH_SECONDS: int = 300
 
     # Rabbit MQ
     RABBITMQ_HOST: str = os.getenv("RABBITMQ_HOST")
@@ -29,12 +122,44 @@ class Settings(BaseSettings):
     SESSION_QUEUE_TEMPLATE:str = "messages-user{session_id}"
     AGENT_QUEUE_TEMPLATE:str = "{tenant_id}.ai_summary"
 
+    # Reply publishing: channel pool, how long a declared queue is trusted, batched publisher confirms
+    PUBLISHER_CHANNEL_POOL_SIZE: int = 4
+    PUBLISHER_DECLARE_CACHE_TTL_SECONDS: int = 300
+    PUBLISHER_CONFIRMS: bool = True
+    PUBLISHER_CONFIRM_BATCH_SIZE: int = 32
+
+    # AI queue consumer: worker pool size, broker prefetch per worker and per-tenant scheduling weights
+    AI_CONSUMER_CONCURRENCY: int = int(os.getenv("AI_CONSUMER_CONCURRENCY", "8"))
+    # Set to false when consumers run as separate app.worker replicas
+    RUN_CONSUMER_IN_API: bool = True
+    # app.worker: health port of the first process (the n-th process listens on port + n),
+    # and how long to wait for in-flight messages on SIGTERM
+    WORKER_HEALTH_PORT: int = 8100
+    WORKER_DRAIN_TIMEOUT_SECONDS: float = 30.0
+    AI_CONSUMER_PREFETCH_PER_WORKER: int = 4
+    TENANT_WEIGHTS: Dict[str, int] = {}
+    DEFAULT_TENANT_WEIGHT: int = 1
+    # Recently received messages kept in memory for /messages, which only serves a consumer
+    # running in the API process
+    RECEIVED_MESSAGES_CAPACITY: int = 1000
+    MESSAGES_PAGE_MAX_LIMIT: int = 200
+    # Every consumer writes its stats to Redis this often; /status and /consumer/stats read them
+    # from there when consumers run as app.worker processes
+    CONSUMER_STATS_INTERVAL_SECONDS: float = 5.0
+    CONSUMER_STATS_KEY_PREFIX: str = "ai_consumer:stats"
+
     # MySQL Configuration (Loaded from .env file)
     MYSQL_USER: str
     MYSQL_PASSWORD: str
     MYSQL_HOST: str
     MYSQL_PORT: int
     MYSQL_DB: str
+    MYSQL_POOL_SIZE: int = 10
+    MYSQL_MAX_OVERFLOW: int = 10
+    MYSQL_POOL_RECYCLE_SECONDS: int = 3600
+
+    # Resolved tenant prompt templates are cached this long (and dropped as soon as one changes)
+    PROMPT_TEMPLATE_CACHE_TTL_SECONDS: int = 300
 
     # MongoDB
     MONGO_HOST:str  = os.getenv('MONGO_HOST', 'localhost')
@@ -44,14 +169,26 @@ class Settings(BaseSettings):
     MONGODB_URL:str = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}:27017/"
 
     DATABASE_NAME:str = "ai_replies_db"
+    # AIReply documents are buffered and written per tenant with insert_many
+    AI_REPLY_WRITE_BATCH_SIZE: int = 50
+    AI_REPLY_FLUSH_INTERVAL_SECONDS: float = 1.0
+    # Failed batch writes are retried with exponential backoff before the documents are dropped
+    AI_REPLY_WRITE_RETRIES: int = 3
+    AI_REPLY_RETRY_BACKOFF_SECONDS: float = 1.0
 
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
     REDIS_PASSWORD: Optional[str] = os.getenv("REDIS_PASSWORD")
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
+    # Pub/sub channel on which tenant_service announces knowledge base changes (payload: tenant_id)
+    KNOWLEDGE_BASE_UPDATES_CHANNEL: str = "knowledge_base_updates"
+    # Pub/sub channel announcing prompt template changes (payload: tenant_id)
+    PROMPT_TEMPLATE_UPDATES_CHANNEL: str = "prompt_template_updates"
+    # Longest wait between attempts to resubscribe to these channels after losing Redis
+    CHANGE_LISTENER_BACKOFF_MAX_SECONDS: float = 30.0
 
     @property
     def database_url(self):
-        return f"mysql+pymysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DB}"
+        return f"mysql+aiomysql://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DB}"
 
     class Config:
         env_file = ".env"
@@ -1,7 +1,4 @@
-import pymysql
-pymysql.install_as_MySQLdb()
-
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
@@ -9,15 +6,19 @@ from app.core.config import settings
 # Database URL (fetch this from settings)
 DATABASE_URL = settings.database_url
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async engine with a bounded connection pool; stale connections are recycled before MySQL drops them
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=settings.MYSQL_POOL_SIZE,
+    max_overflow=settings.MYSQL_MAX_OVERFLOW,
+    pool_recycle=settings.MYSQL_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=True
+)
+SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 # SQLAlchemy Base
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def get_db() -> AsyncSession:
+    async with SessionLocal() as session:
+        yield session
@@ -0,0 +1,100 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency buckets (seconds) spanning cache hits to slow completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+MESSAGE_LATENCY = Histogram(
+    "ai_message_latency_seconds",
+    "Time from RabbitMQ delivery of a customer message to publish of the AI reply",
+    buckets=LATENCY_BUCKETS
+)
+EMBEDDING_LATENCY = Histogram(
+    "ai_embedding_latency_seconds",
+    "Latency of embedding API calls",
+    buckets=LATENCY_BUCKETS
+)
+MILVUS_SEARCH_LATENCY = Histogram(
+    "ai_milvus_search_latency_seconds",
+    "Latency of Milvus vector searches",
+    buckets=LATENCY_BUCKETS
+)
+CHAT_COMPLETION_LATENCY = Histogram(
+    "ai_chat_completion_latency_seconds",
+    "Latency of chat completion API calls",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+REDIS_PUSH_LATENCY = Histogram(
+    "ai_redis_push_latency_seconds",
+    "Latency of pushing AI replies to the Redis chat history",
+    buckets=LATENCY_BUCKETS
+)
+TOKEN_BUDGET_WAIT = Histogram(
+    "ai_token_budget_wait_seconds",
+    "Time OpenAI calls waited for the token-per-minute budget",
+    buckets=LATENCY_BUCKETS
+)
+
+MESSAGES_PROCESSED = Counter(
+    "ai_messages_processed_total",
+    "Customer messages processed by the AI consumer",
+    ["tenant_id"]
+)
+HANDOVERS_TRIGGERED = Counter(
+    "ai_handovers_triggered_total",
+    "Handovers to a human agent, by outcome",
+    ["outcome"]
+)
+STAGE_ERRORS = Counter(
+    "ai_stage_errors_total",
+    "Errors raised per processing stage",
+    ["stage"]
+)
+COMPLETION_BACKEND_FAILURES = Counter(
+    "ai_completion_backend_failures_total",
+    "Failed or timed out calls per completion backend tier",
+    ["backend"]
+)
+HEDGED_COMPLETIONS = Counter(
+    "ai_hedged_completions_total",
+    "Hedge requests sent for slow chat completions, and how many of them won",
+    ["outcome"]
+)
+TOKENS_USED = Counter(
+    "ai_tokens_total",
+    "LLM tokens consumed, per tenant and direction",
+    ["tenant_id", "type"]
+)
+
+IN_FLIGHT_MESSAGES = Gauge(
+    "ai_in_flight_messages",
+    "Messages currently being processed by AI workers"
+)
+LLM_CONCURRENCY_LIMIT = Gauge(
+    "ai_llm_concurrency_limit",
+    "Current adaptive limit on concurrent OpenAI calls",
+    ["operation"]
+)
+LLM_IN_FLIGHT = Gauge(
+    "ai_llm_in_flight_calls",
+    "OpenAI calls currently holding a concurrency slot",
+    ["operation"]
+)
+LLM_OBSERVED_RTT = Gauge(
+    "ai_llm_observed_rtt_seconds",
+    "Recent (short EWMA) round-trip time of OpenAI calls",
+    ["operation"]
+)
+LLM_BASELINE_RTT = Gauge(
+    "ai_llm_baseline_rtt_seconds",
+    "Baseline (long EWMA) round-trip time of OpenAI calls",
+    ["operation"]
+)
+
+
+def record_token_usage(ai_reply):
+    """
+    Adds the token counts of a saved AIReply to the per-tenant token counter.
+    """
+    for token_type, token_info in ai_reply.tokens.items():
+        TOKENS_USED.labels(tenant_id=ai_reply.tenant_id, type=token_type).inc(token_info.count)
@@ -32,3 +32,45 @@ INSTRUCTIONS:
 2. Highlight unresolved issue the customer is facing.
 3. Use bullet points for clarity when appropriate. 
 """
+
+SUMMARY_UPDATE_PROMPT_TEMPLATE = """
+You are a customer service agent assistant. Your goal is to provide brief summary of user's needs and issues. You will reply with traditional Chinese.
+
+PREVIOUS SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{history}
+
+INSTRUCTIONS:
+1. Update the previous summary with the new messages, keeping what is still relevant.
+2. Highlight unresolved issue the customer is facing.
+3. Use bullet points for clarity when appropriate. 
+"""
+
+SUMMARY_SEGMENT_PROMPT_TEMPLATE = """
+You are a customer service agent assistant. The conversation below is part {part} of {parts} of a long chat with a customer. You will reply with traditional Chinese.
+
+HISTORY:
+{history}
+
+INSTRUCTIONS:
+1. Summarize the customer's needs, the issues raised and what has been done about them in this part.
+2. Keep order numbers, product names, dates and other concrete details.
+3. Be concise; the summaries of all parts will be combined afterwards.
+"""
+
+SUMMARY_REDUCE_PROMPT_TEMPLATE = """
+You are a customer service agent assistant. Your goal is to provide brief summary of user's needs and issues. You will reply with traditional Chinese.
+
+PREVIOUS SUMMARY:
+{summary}
+
+SUMMARIES OF THE CONVERSATION PARTS, IN ORDER:
+{partials}
+
+INSTRUCTIONS:
+1. Combine the previous summary and the part summaries into one summary of the whole chat.
+2. Highlight unresolved issue the customer is facing.
+3. Use bullet points for clarity when appropriate. 
+"""
@@ -0,0 +1,14 @@
+import aioredis
+
+from app.core.config import settings
+
+REDIS_HOST = settings.REDIS_HOST
+REDIS_PASSWORD = settings.REDIS_PASSWORD
+REDIS_PORT = settings.REDIS_PORT
+
+# Shared async Redis client (connections are opened lazily from the pool)
+redis_url = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}"
+redis_client = aioredis.from_url(redis_url, encoding="utf-8", decode_responses=True)
+
+# Client without response decoding, for values stored as raw bytes (e.g. packed embeddings)
+redis_binary_client = aioredis.from_url(redis_url, decode_responses=False)
@@ -17,6 +17,11 @@ class AIReply(BaseModel):
     customer_feedback: Optional[bool] = None
     tenant_id: str
     created_at: datetime = datetime.now(timezone.utc)
+    stage_timings: Optional[Dict[str, float]] = None  # Wall time per pipeline stage, in milliseconds
+    cache_hit: Optional[bool] = None
+    hedged: Optional[bool] = None  # A second completion request was sent for a slow one
+    hedge_won: Optional[bool] = None  # ... and its answer was the one used
+    completion_backend: Optional[str] = None  # Name of the completion backend tier that answered
 
     @classmethod
     def from_openai_completion(cls, receiver: str, user_query: str, completion: Completion | str, tenant_id: str,
@@ -1,5 +1,14 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
 
 class SearchRequest(BaseModel):
     query: str
     tenant_id: str
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=settings.RAG_BATCH_MAX_QUERIES)
+    tenant_id: str
+    dry_run: bool = False  # Skip writing AIReply usage documents
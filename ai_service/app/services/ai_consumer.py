@@ -0,0 +1,389 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractQueue, AbstractRobustConnection
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.metrics import (IN_FLIGHT_MESSAGES, MESSAGE_LATENCY, MESSAGES_PROCESSED, REDIS_PUSH_LATENCY,
+                              STAGE_ERRORS, record_token_usage)
+from app.core.prompt import SUMMARY_PROMPT_TEMPLATE
+from app.core.redis_client import redis_client
+from app.schemas.ai_reply import AIReply
+from app.schemas.chat_message import ChatMessage, MessageType, SourceType
+from app.services.consumer_stats import consumer_stats
+from app.services.llm_service import build_completion, rag_pipeline, summarize
+from app.services.message_log import ReceivedMessageLog
+from app.services.mongodb_service import reply_writer
+from app.services.pipeline_trace import PipelineTrace
+from app.services.prompt_template_cache import prompt_templates
+from app.services.publisher import publisher
+from app.services.tenant_scheduler import TenantFairScheduler
+
+SESSION_QUEUE_TEMPLATE = settings.SESSION_QUEUE_TEMPLATE
+AGENT_QUEUE_TEMPLATE = settings.AGENT_QUEUE_TEMPLATE
+AI_MESSAGE_QUEUE = settings.AI_MESSAGE_QUEUE
+STREAM_REPLIES = settings.STREAM_REPLIES
+STREAM_CHUNK_MIN_CHARS = settings.STREAM_CHUNK_MIN_CHARS
+# Message types carrying the reply itself; their publish waits for the broker confirm
+REPLY_MESSAGE_TYPES = ("CHAT", "CHAT_END")
+input_token_price = settings.INPUT_TOKEN_PRICE
+output_token_price = settings.OUTPUT_TOKEN_PRICE
+
+# Background summaries precomputed for handovers
+handover_summary_tasks: Set[asyncio.Task] = set()
+
+
+class ReceivedMessage(BaseModel):
+    session_id: Optional[str] = None
+    sender: str
+    content: Optional[str] = None
+    type: str
+    tenant_id: str
+    user_type: Optional[str] = None
+    receiver: Optional[str] = None
+
+
+class AIMessageConsumer:
+    """
+    Consumes AI_MESSAGE_QUEUE and replies to each customer message with the RAG pipeline.
+
+    Deliveries are handed to a tenant-fair scheduler with a fixed number of workers and
+    acknowledged once processed. Runs inside the API process or standalone (see app.worker).
+    """
+
+    def __init__(self, concurrency: int = settings.AI_CONSUMER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.scheduler = TenantFairScheduler(
+            self.process_message,
+            concurrency=concurrency,
+            weights=settings.TENANT_WEIGHTS,
+            default_weight=settings.DEFAULT_TENANT_WEIGHT
+        )
+        # Bounded in-memory log of recently received messages
+        self.received_messages = ReceivedMessageLog(capacity=settings.RECEIVED_MESSAGES_CAPACITY)
+        self.running = False
+        self.draining = False
+        self._channel: Optional[AbstractChannel] = None
+        self._queue: Optional[AbstractQueue] = None
+        self._consumer_tag: Optional[str] = None
+        self._stats_task: Optional[asyncio.Task] = None
+
+    async def start(self, connection: AbstractRobustConnection):
+        self._channel = await connection.channel()
+
+        # Bound unacknowledged deliveries to what the worker pool can chew through,
+        # with some headroom so the scheduler has several tenants to choose from
+        await self._channel.set_qos(prefetch_count=self.concurrency * settings.AI_CONSUMER_PREFETCH_PER_WORKER)
+        await self.scheduler.start()
+
+        # Declare or get the queue
+        self._queue = await self._channel.declare_queue(AI_MESSAGE_QUEUE, durable=True)
+
+        # Start consuming messages from the AI queue
+        self._consumer_tag = await self._queue.consume(self.on_message_received)
+        self.running = True
+        self._stats_task = asyncio.create_task(consumer_stats.run(self.snapshot))
+        logging.info(f"[*] Started consuming from queue: {AI_MESSAGE_QUEUE}")
+
+    async def drain(self, timeout: float):
+        """
+        Stops taking new deliveries and waits up to timeout seconds for queued and in-flight
+        messages (and pending handover summaries) to finish. Messages still in flight afterwards
+        are requeued when stop() cancels their workers, and any other unacknowledged delivery is
+        redelivered by the broker once the channel closes.
+        """
+        if not self.running or self.draining:
+            return
+        self.draining = True
+        logging.info("[*] Draining AI consumer")
+        if self._queue and self._consumer_tag:
+            await self._queue.cancel(self._consumer_tag)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.scheduler.queued() or self.scheduler.in_flight) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if handover_summary_tasks and loop.time() < deadline:
+            await asyncio.wait(list(handover_summary_tasks), timeout=deadline - loop.time())
+        logging.info(f"[*] AI consumer drained ({self.scheduler.queued()} queued, "
+                     f"{self.scheduler.in_flight} in flight left)")
+
+    async def stop(self):
+        if self._stats_task:
+            self._stats_task.cancel()
+        await self.scheduler.stop()
+        for task in list(handover_summary_tasks):
+            task.cancel()
+        if self._channel and not self._channel.is_closed:
+            await self._channel.close()
+        self.running = False
+
+    def health(self) -> dict:
+        return {
+            "status": "draining" if self.draining else ("ok" if self.running else "starting"),
+            "concurrency": self.concurrency,
+            "in_flight": self.scheduler.in_flight,
+            "queued": self.scheduler.queued(),
+            "processed": self.received_messages.total,
+        }
+
+    def snapshot(self) -> dict:
+        """
+        What the API reports about this consumer when it runs elsewhere (see consumer_stats).
+        """
+        return {
+            "health": self.health(),
+            "messages": self.received_messages.stats(),
+            "scheduler": self.scheduler.stats(),
+        }
+
+    async def on_message_received(self, message: AbstractIncomingMessage):
+        """
+        Parses the delivery and hands it to the tenant-fair scheduler.
+        The message is acknowledged once a worker has processed it.
+        """
+        try:
+            # Decode and parse the incoming message
+            msg_content = message.body.decode()
+            msg_json = json.loads(msg_content)
+            logging.info(f"[>] Received message: {msg_json}")
+
+            # Validate the message
+            received_msg = ReceivedMessage(**msg_json)
+        except json.JSONDecodeError:
+            logging.error("[!] Failed to decode message")
+            STAGE_ERRORS.labels(stage="decode").inc()
+            await message.ack()
+            return
+        except Exception as e:
+            logging.error(f"[!] Error processing message: {e}")
+            STAGE_ERRORS.labels(stage="decode").inc()
+            await message.ack()
+            return
+
+        self.scheduler.submit(received_msg.tenant_id, (message, received_msg, time.monotonic()))
+
+    async def process_message(self, item):
+        message, received_msg, delivered_at = item
+        # Requeue, not drop, a message whose worker is cancelled by stop() after a drain timeout;
+        # every other error is handled inside and acknowledges the message
+        async with message.process(requeue=True):
+            with IN_FLIGHT_MESSAGES.track_inprogress():
+                try:
+                    # Store the message
+                    self.received_messages.append(received_msg)
+
+                    # Send the AI reply
+                    logging.info(f"[>] CHAT")
+                    await reply_with_rag(received_msg, delivered_at)
+                    MESSAGES_PROCESSED.labels(tenant_id=received_msg.tenant_id).inc()
+
+                except Exception as e:
+                    logging.error(f"[!] Error processing message: {e}")
+                    STAGE_ERRORS.labels(stage="message").inc()
+
+
+async def reply_with_rag(received_msg: ReceivedMessage, delivered_at: Optional[float] = None):
+    trace = PipelineTrace()
+    await trace.timed("acknowledgement", send_acknowledgement_message(received_msg))
+    response = await send_reply_message(received_msg, trace)
+    if delivered_at is not None:
+        MESSAGE_LATENCY.observe(time.monotonic() - delivered_at)
+    if isinstance(response, str):
+        # The handover and empty-reply paths of rag_pipeline answer with plain text
+        response = build_completion(response, None)
+
+    receiver = received_msg.sender
+    query = received_msg.content
+    tenant_id = received_msg.tenant_id
+
+    ai_reply = AIReply.from_openai_completion(receiver, query, response, tenant_id, input_token_price,
+                                              output_token_price)
+    trace.apply(ai_reply)
+
+    reply_writer.add(ai_reply)
+    record_token_usage(ai_reply)
+
+    timestamp  = time.time()
+
+    # Create ChatMessage instance for the reply
+    chat_message = ChatMessage(
+        session_id=received_msg.session_id,
+        type=MessageType.CHAT,
+        content=response.choices[0].message.content,
+        sender="AI",
+        sender_name="AI",
+        receiver=received_msg.sender,
+        tenant_id=tenant_id,
+        timestamp=timestamp,
+        source=SourceType.AI,
+        user_type="agent",
+        customer_id=received_msg.sender
+    )
+
+    logging.info(f"[>] Chat message: {chat_message}")
+
+    # Serialize ChatMessage to JSON
+    chat_message_json = chat_message.to_json()
+
+    # Define Redis key following the Java service pattern
+    redis_key = f"tenant:{tenant_id}:chat:customer_messages:{received_msg.session_id}"
+
+    # Push the serialized message to Redis
+    with REDIS_PUSH_LATENCY.time():
+        await redis_client.rpush(redis_key, chat_message_json)
+    logging.debug(f"Saved message to Redis under key: {redis_key}")
+
+    # Have the summary ready before the agent picks the session up
+    if trace.handover:
+        task = asyncio.create_task(precompute_handover_summary(received_msg))
+        handover_summary_tasks.add(task)
+        task.add_done_callback(handover_summary_tasks.discard)
+
+
+async def precompute_handover_summary(received_msg: ReceivedMessage):
+    """
+    Summarizes a session that was just handed over and publishes the summary to the tenant's
+    agent queue. summarize stores it in Redis as well, so /summary returns it without another
+    LLM call until new messages arrive.
+    """
+    try:
+        response = await summarize(received_msg.tenant_id, SUMMARY_PROMPT_TEMPLATE, received_msg.sender)
+        if not response:
+            return
+
+        ai_reply = AIReply.from_openai_completion("AGENT", "", response, received_msg.tenant_id,
+                                                  input_token_price, output_token_price)
+        reply_writer.add(ai_reply)
+        record_token_usage(ai_reply)
+
+        await publish_summary_to_queue(received_msg, response.choices[0].message.content)
+    except Exception as e:
+        logging.error(f"[!] Error precomputing handover summary: {e}")
+        STAGE_ERRORS.labels(stage="summary").inc()
+
+
+async def publish_message_to_queue(received_msg: ReceivedMessage, message_type: str, content: str = "",
+                                   sequence: Optional[int] = None):
+    """
+    Helper method to publish a message to the user's queue.
+    This method handles message creation; the publisher takes care of queue declaration and confirms.
+    Streamed messages (CHAT_CHUNK / CHAT_END) carry a sequence number.
+    """
+    current_timestamp = datetime.now(timezone.utc).isoformat()
+    reply_message = {
+        "session_id": received_msg.session_id,
+        "sender": "ai",
+        "content": content,
+        "type": message_type,
+        "tenant_id": received_msg.tenant_id,
+        "user_type": "AI",
+        "SourceType": "AI",
+        "receiver": received_msg.sender,
+        "timestamp": current_timestamp
+    }
+    if sequence is not None:
+        reply_message["sequence"] = sequence
+
+    # Determine the user queue name based on session ID
+    user_queue_name = SESSION_QUEUE_TEMPLATE.format(session_id=received_msg.session_id)
+    logging.info(f"Publishing message to default exchange with routing_key: {user_queue_name}")
+
+    # Publish the message to the default exchange (the queue is declared once and cached).
+    # The reply itself (CHAT / CHAT_END) waits for its broker confirm, so the inbound message
+    # is only acked once the reply is safely queued.
+    await publisher.publish(user_queue_name, reply_message,
+                            wait_for_confirm=message_type in REPLY_MESSAGE_TYPES)
+
+    logging.info(f"[<] Sent {message_type} message to user queue: {user_queue_name}")
+
+async def publish_summary_to_queue(received_msg: ReceivedMessage, content: str = ""):
+    """
+    Helper method to publish a summary to the tenant's agent queue.
+    This method handles message creation; the publisher takes care of queue declaration and confirms.
+    """
+    current_timestamp = datetime.now(timezone.utc).isoformat()
+    reply_message = {
+        "session_id": received_msg.session_id,
+        "sender": "ai",
+        "content": content,
+        "type": "SUMMARY",
+        "tenant_id": received_msg.tenant_id,
+        "user_type": "AI",
+        "SourceType": "AI",
+        "receiver": received_msg.sender,
+        "timestamp": current_timestamp
+    }
+
+    # Determine the user queue name based on session ID
+    agent_queue_name = AGENT_QUEUE_TEMPLATE.format(tenant_id=received_msg.tenant_id)
+    logging.info(f"Publishing message to agent with routing_key: {agent_queue_name}")
+
+    # Publish the message to the default exchange (the queue is declared once and cached)
+    await publisher.publish(agent_queue_name, reply_message)
+
+    logging.info(f"[<] Sent summary message to user queue: {agent_queue_name}")
+
+
+async def send_reply_message(received_msg: ReceivedMessage, trace: PipelineTrace):
+    """
+    Sends a reply message back to the customer with modified sender and SourceType.
+    Utilizes the default exchange for direct messaging to user queues.
+    """
+    if STREAM_REPLIES:
+        return await send_streamed_reply_message(received_msg, trace)
+
+    prompt_template = await prompt_templates.get(received_msg.tenant_id)
+    response = await rag_pipeline(received_msg.content, received_msg.tenant_id, prompt_template,
+                                  received_msg.session_id, received_msg.sender, trace=trace)
+
+    if isinstance(response, str):
+        reply_content = response
+    else:
+        reply_content = response.choices[0].message.content
+    await trace.timed("publish", publish_message_to_queue(received_msg, "CHAT", reply_content))
+    return response
+
+async def send_streamed_reply_message(received_msg: ReceivedMessage, trace: PipelineTrace):
+    """
+    Streams the reply to the customer as numbered CHAT_CHUNK messages while it is generated,
+    then publishes a CHAT_END carrying the complete reply.
+    """
+    sequence = 0
+    pending = []
+
+    async def flush():
+        nonlocal sequence
+        if pending:
+            await publish_message_to_queue(received_msg, "CHAT_CHUNK", "".join(pending), sequence=sequence)
+            sequence += 1
+            pending.clear()
+
+    async def on_delta(delta: str):
+        pending.append(delta)
+        if sum(len(part) for part in pending) >= STREAM_CHUNK_MIN_CHARS:
+            await flush()
+
+    prompt_template = await prompt_templates.get(received_msg.tenant_id)
+    response = await rag_pipeline(received_msg.content, received_msg.tenant_id, prompt_template,
+                                  received_msg.session_id, received_msg.sender, on_delta=on_delta, trace=trace)
+    await flush()
+
+    if isinstance(response, str):
+        reply_content = response
+    else:
+        reply_content = response.choices[0].message.content
+    await trace.timed("publish", publish_message_to_queue(received_msg, "CHAT_END", reply_content, sequence=sequence))
+    return response
+
+async def send_acknowledgement_message(received_msg: ReceivedMessage):
+    """
+    Sends an acknowledgement message back to the customer to notify AI processing state.
+    Utilizes the default exchange for direct messaging to user queues.
+    """
+    await publish_message_to_queue(received_msg, "ACKNOWLEDGEMENT")
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_message import FunctionCall
+
+from app.core.config import settings
+from app.core.metrics import COMPLETION_BACKEND_FAILURES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def build_completion(content: Optional[str], usage: Optional[CompletionUsage], finish_reason: str = "stop",
+                     function_call: Optional[FunctionCall] = None, model: str = settings.CHAT_COMPLETION_MODEL,
+                     completion_id: str = "") -> ChatCompletion:
+    """
+    Assembles a ChatCompletion from parts, for replies that did not come back as a single response object.
+    """
+    return ChatCompletion(
+        id=completion_id,
+        object="chat.completion",
+        created=int(time.time()),
+        model=model,
+        choices=[Choice(
+            index=0,
+            finish_reason=finish_reason,
+            message=ChatCompletionMessage(role="assistant", content=content, function_call=function_call)
+        )],
+        usage=usage or CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+    )
+
+
+async def stream_chat_completion(client: AsyncOpenAI, on_delta: Callable[[str], Awaitable[None]],
+                                 chunk_timeout: Optional[float] = None, **kwargs) -> ChatCompletion:
+    """
+    Calls the chat API with stream=True, forwarding each content delta to on_delta as it arrives,
+    and returns the assembled ChatCompletion including token usage.
+    chunk_timeout bounds the wait for the first chunk and for each following one; the time
+    on_delta takes is not counted.
+    """
+    stream = await asyncio.wait_for(
+        client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs),
+        timeout=chunk_timeout
+    )
+    chunks = stream.__aiter__()
+
+    completion_id = ""
+    model = kwargs.get("model", settings.CHAT_COMPLETION_MODEL)
+    content_parts = []
+    function_name = ""
+    function_arguments = []
+    finish_reason = "stop"
+    usage = None
+
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=chunk_timeout)
+        except StopAsyncIteration:
+            break
+        completion_id = chunk.id or completion_id
+        model = chunk.model or model
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta.content:
+            content_parts.append(delta.content)
+            await on_delta(delta.content)
+        if delta.function_call:
+            function_name += delta.function_call.name or ""
+            function_arguments.append(delta.function_call.arguments or "")
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+
+    function_call = None
+    if function_name:
+        function_call = FunctionCall(name=function_name, arguments="".join(function_arguments))
+
+    return build_completion("".join(content_parts) or None, usage, finish_reason, function_call, model, completion_id)
+
+
+class CompletionBackend(ABC):
+    """
+    One tier of the completion chain. Subclasses implement complete(); tests can register a
+    fake one returning build_completion(...) results.
+    """
+
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timeout
+
+    @abstractmethod
+    async def complete(self, on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                       timeout: Optional[float] = None, **kwargs) -> ChatCompletion:
+        """
+        When streaming to on_delta, implementations bound the wait for each chunk by timeout.
+        """
+
+    async def run(self, on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                  timeout: Optional[float] = None, **kwargs) -> ChatCompletion:
+        """
+        complete(), bounded by timeout (default: the backend's). A streamed call is bounded per
+        chunk by complete() instead, so a long reply is not cut off while it is being forwarded.
+        """
+        timeout = timeout or self.timeout
+        if on_delta:
+            return await self.complete(on_delta, timeout, **kwargs)
+        return await asyncio.wait_for(self.complete(None, timeout, **kwargs), timeout=timeout)
+
+
+class OpenAICompletionBackend(CompletionBackend):
+    """
+    A chat model behind the OpenAI API or any OpenAI-compatible endpoint (base_url).
+    The backend's model replaces whatever model the caller passed.
+    """
+
+    def __init__(self, name: str, model: str, timeout: float, base_url: Optional[str] = None,
+                 api_key: Optional[str] = None, max_retries: Optional[int] = None):
+        super().__init__(name, timeout)
+        self.model = model
+        client_options = {} if max_retries is None else {"max_retries": max_retries}
+        self.client = AsyncOpenAI(api_key=api_key or settings.OPENAI_API_KEY, base_url=base_url,
+                                  timeout=timeout, **client_options)
+
+    async def complete(self, on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                       timeout: Optional[float] = None, **kwargs) -> ChatCompletion:
+        kwargs["model"] = self.model
+        if timeout is not None:
+            # Overrides the client's timeout for this request
+            kwargs["timeout"] = timeout
+        if on_delta:
+            return await stream_chat_completion(self.client, on_delta, chunk_timeout=timeout, **kwargs)
+        return await self.client.chat.completions.create(**kwargs)
+
+
+class CompletionBackendChain:
+    """
+    Ordered completion backends: a call is tried on one tier after the other until one
+    succeeds. The last error is raised when every tier failed.
+    """
+
+    def __init__(self, backends: Optional[List[CompletionBackend]] = None):
+        self.backends: List[CompletionBackend] = list(backends or [])
+
+    @classmethod
+    def from_settings(cls, tiers: List[Dict[str, Any]]) -> "CompletionBackendChain":
+        return cls([
+            OpenAICompletionBackend(
+                name=tier["name"],
+                model=tier.get("model") or settings.CHAT_COMPLETION_MODEL,
+                timeout=tier.get("timeout", settings.COMPLETION_TIMEOUT_SECONDS),
+                base_url=tier.get("base_url"),
+                api_key=tier.get("api_key"),
+                max_retries=tier.get("max_retries")
+            )
+            for tier in tiers
+        ])
+
+    @property
+    def primary(self) -> CompletionBackend:
+        return self.backends[0]
+
+    def register(self, backend: CompletionBackend, index: Optional[int] = None):
+        """
+        Adds a backend at index (default: last), replacing any backend with the same name.
+        """
+        self.unregister(backend.name)
+        self.backends.insert(len(self.backends) if index is None else index, backend)
+
+    def unregister(self, name: str):
+        self.backends = [backend for backend in self.backends if backend.name != name]
+
+    async def complete(self, call: Callable[[CompletionBackend], Awaitable[T]],
+                       can_fall_through: Callable[[], bool] = lambda: True) -> T:
+        """
+        Awaits call(backend) for each tier in turn. can_fall_through() is asked after a failure,
+        e.g. to stop once part of a streamed reply has reached the customer.
+        """
+        if not self.backends:
+            raise RuntimeError("No completion backends configured.")
+
+        for position, backend in enumerate(self.backends):
+            try:
+                return await call(backend)
+            except Exception as e:
+                COMPLETION_BACKEND_FAILURES.labels(backend=backend.name).inc()
+                last = position == len(self.backends) - 1
+                if last or not can_fall_through():
+                    raise
+                logger.warning(f"Completion backend {backend.name} failed ({type(e).__name__}: {e}), "
+                               f"falling back to {self.backends[position + 1].name}")
+
+
+completion_backends = CompletionBackendChain.from_settings(settings.COMPLETION_BACKENDS)
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from typing import Callable, List
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class ConsumerStatsStore:
+    """
+    Snapshots of every AI consumer's stats in Redis, so the API can report on consumers that run
+    in app.worker processes. Each consumer rewrites its own key every interval seconds; the key
+    expires after a few missed intervals, so stopped consumers drop out on their own.
+    """
+
+    def __init__(self, client, interval: float, key_prefix: str):
+        self.client = client
+        self.interval = interval
+        self.key_prefix = key_prefix
+        self.consumer_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def publish(self, snapshot: dict):
+        await self.client.set(f"{self.key_prefix}:{self.consumer_id}",
+                              json.dumps({"consumer": self.consumer_id, **snapshot}),
+                              ex=max(1, int(self.interval * 3)))
+
+    async def run(self, snapshot: Callable[[], dict]):
+        """
+        Publishes snapshot() every interval until cancelled.
+        """
+        while True:
+            try:
+                await self.publish(snapshot())
+            except Exception as e:
+                logger.error(f"Failed to publish consumer stats: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def collect(self) -> List[dict]:
+        keys = [key async for key in self.client.scan_iter(match=f"{self.key_prefix}:*")]
+        if not keys:
+            return []
+        return [json.loads(value) for value in await self.client.mget(keys) if value]
+
+
+consumer_stats = ConsumerStatsStore(
+    redis_client,
+    interval=settings.CONSUMER_STATS_INTERVAL_SECONDS,
+    key_prefix=settings.CONSUMER_STATS_KEY_PREFIX
+)
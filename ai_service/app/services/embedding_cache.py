@@ -0,0 +1,96 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.redis_client import redis_binary_client
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings: an in-process LRU in front of Redis shared by all workers.
+
+    Keys are derived from the normalized query text, the embedding model and the storage dtype,
+    and vectors are stored as packed float32/float16 bytes rather than JSON lists.
+    """
+
+    def __init__(self, redis_client, model: str, max_entries: int, ttl: int, dtype: str = "float32"):
+        self.redis = redis_client
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dtype = np.dtype(dtype)
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.strip().lower().split())
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha1(self.normalize(text).encode("utf-8")).hexdigest()
+        # The dtype is part of the key: bytes packed as float16 must never be read back as float32
+        return f"embedding:{self.model}:{self.dtype.name}:{digest}"
+
+    def _remember(self, key: str, embedding: List[float]):
+        self._local[key] = embedding
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        key = self._key(text)
+        embedding = self._local.get(key)
+        if embedding is not None:
+            self._local.move_to_end(key)
+            self.local_hits += 1
+            return embedding
+
+        try:
+            packed = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            packed = None
+
+        if packed is None:
+            self.misses += 1
+            return None
+
+        embedding = np.frombuffer(packed, dtype=self.dtype).astype(np.float32).tolist()
+        self._remember(key, embedding)
+        self.redis_hits += 1
+        return embedding
+
+    async def set(self, text: str, embedding: List[float]):
+        key = self._key(text)
+        self._remember(key, embedding)
+        try:
+            await self.redis.set(key, np.asarray(embedding, dtype=self.dtype).tobytes(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "local_size": len(self._local),
+        }
+
+
+embedding_cache = EmbeddingCache(
+    redis_binary_client,
+    model=settings.EMBEDDING_MODEL,
+    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+    ttl=settings.EMBEDDING_CACHE_TTL_SECONDS,
+    dtype=settings.EMBEDDING_CACHE_DTYPE
+)
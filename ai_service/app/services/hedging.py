@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.metrics import HEDGED_COMPLETIONS
+from app.services.pipeline_trace import PipelineTrace
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _retrieve_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+class CompletionHedger:
+    """
+    Hedges slow completions: if a call has not returned after the given percentile of recently
+    observed latencies, an identical second call is started. The first successful result wins
+    and the other call is cancelled.
+
+    Latencies are fed in through observe() by the calls themselves, counting only the API call
+    and not the time spent waiting for token budget or a concurrency slot. No hedge is sent until
+    min_samples latencies have been observed. The extra tokens are capped per tenant and minute
+    (counted with the cost estimate of each hedge, in this process); over the cap, slow calls are
+    simply awaited.
+    """
+
+    def __init__(self, percentile: float, min_samples: int, window: int, tenant_tokens_per_minute: int):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.tenant_tokens_per_minute = tenant_tokens_per_minute
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self._tenant_usage: Dict[str, Tuple[float, int]] = {}
+        self._pruned_at = time.monotonic()
+
+    def observe(self, latency: float):
+        self.latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))]
+
+    def _allow(self, tenant_id: str, tokens: int) -> bool:
+        now = time.monotonic()
+        if now - self._pruned_at >= 60:
+            # Forget the windows of tenants that have not hedged for a minute
+            self._tenant_usage = {tenant: usage for tenant, usage in self._tenant_usage.items()
+                                  if now - usage[0] < 60}
+            self._pruned_at = now
+        window_start, used = self._tenant_usage.get(tenant_id, (now, 0))
+        if now - window_start >= 60:
+            window_start, used = now, 0
+        if used + tokens > self.tenant_tokens_per_minute:
+            return False
+        self._tenant_usage[tenant_id] = (window_start, used + tokens)
+        return True
+
+    def _start(self, call: Callable[[], Awaitable[T]]) -> asyncio.Task:
+        task = asyncio.create_task(call())
+        task.add_done_callback(_retrieve_exception)
+        return task
+
+    async def run(self, tenant_id: str, call: Callable[[], Awaitable[T]], cost: Callable[[], int],
+                  trace: Optional[PipelineTrace] = None, can_hedge: Callable[[], bool] = lambda: True) -> T:
+        """
+        Awaits call(), hedging it with a second call() if it is slow. cost() estimates the
+        tokens of one call and is only evaluated when a hedge is considered. can_hedge() is asked
+        before sending the hedge, e.g. to hold it back while the API is already saturated.
+        """
+        primary = self._start(call)
+        hedge = None
+        try:
+            delay = self.delay()
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not can_hedge() or not self._allow(tenant_id, cost()):
+                return await primary
+
+            HEDGED_COMPLETIONS.labels(outcome="sent").inc()
+            if trace is not None:
+                trace.hedged = True
+            hedge = self._start(call)
+
+            done, _ = await asyncio.wait({primary, hedge}, return_when=asyncio.FIRST_COMPLETED)
+            winner = primary if primary in done else hedge
+            if winner.exception() is not None:
+                # The first to finish failed; the other one may still answer
+                other = hedge if winner is primary else primary
+                await asyncio.wait({other})
+                if other.exception() is None:
+                    winner = other
+
+            if winner is hedge and hedge.exception() is None:
+                HEDGED_COMPLETIONS.labels(outcome="won").inc()
+                if trace is not None:
+                    trace.hedge_won = True
+                logger.info(f"Hedged completion won after {delay:.2f}s for tenant {tenant_id}")
+            return winner.result()
+        finally:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+
+
+completion_hedger = CompletionHedger(
+    percentile=settings.HEDGE_LATENCY_PERCENTILE,
+    min_samples=settings.HEDGE_MIN_SAMPLES,
+    window=settings.HEDGE_LATENCY_WINDOW,
+    tenant_tokens_per_minute=settings.HEDGE_TENANT_TOKENS_PER_MINUTE
+)
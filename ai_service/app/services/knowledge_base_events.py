@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Callable, Iterable
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def listen_for_knowledge_base_changes(redis_client, handlers: Iterable[Callable[[str], None]],
+                                            channel: str = settings.KNOWLEDGE_BASE_UPDATES_CHANNEL,
+                                            on_resubscribe: Iterable[Callable[[], None]] = ()):
+    """
+    Subscribes to the channel on which tenant_service announces knowledge base changes
+    (or to another per-tenant change channel) and calls every handler with the tenant_id
+    of each announcement.
+
+    Runs until cancelled: a lost Redis connection is retried with exponential backoff, and
+    since announcements may have been missed meanwhile, every on_resubscribe callback
+    (e.g. "invalidate everything") is called once subscribed again.
+    """
+    handlers = list(handlers)
+    attempt = 0
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            if attempt:
+                logger.info(f"Resubscribed to {channel}, invalidating everything it covers")
+                for callback in on_resubscribe:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.error(f"Resubscribe callback for {channel} failed: {e}")
+            attempt = 0
+
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                tenant_id = message["data"]
+                logger.info(f"Change announced on {channel} for tenant {tenant_id}")
+                for handler in handlers:
+                    try:
+                        handler(tenant_id)
+                    except Exception as e:
+                        logger.error(f"Change handler for {channel} failed for tenant {tenant_id}: {e}")
+            raise ConnectionError("subscription ended")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            attempt += 1
+            delay = min(settings.CHANGE_LISTENER_BACKOFF_MAX_SECONDS, 2 ** (attempt - 1))
+            logger.error(f"Listener on {channel} lost its subscription ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+                await pubsub.close()
+            except Exception:
+                pass
@@ -1,28 +1,54 @@
+import asyncio
 import json
+import random
 import time
-from typing import Union
+from typing import Awaitable, Callable, Optional, Union
 
-from openai import OpenAI
-
-import requests
+import httpx
+from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletion
-from pydantic import BaseModel
-from openai import OpenAI
 
 from pymilvus import Collection, connections
+from app.core.adaptive_limiter import chat_limiters
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.concurrency import run_blocking
+from app.core.metrics import CHAT_COMPLETION_LATENCY, HANDOVERS_TRIGGERED, STAGE_ERRORS
+from app.core.token_budget import token_budget
+from app.services.completion_backends import CompletionBackend, build_completion, completion_backends
+from app.services.hedging import completion_hedger
 from app.services.language_service import detect_language
-from app.services.redis_service import get_formatted_chat_history
-from app.services.tenant_prompt_service import get_template_by_id, search_vectors_in_tenant_db
+from app.services.pipeline_trace import PipelineTrace
+from app.services.publisher import publisher
+from app.services.redis_service import ChatHistoryWindow, chat_history
+from app.services.semantic_cache import semantic_cache
+from app.services.prompt_template_cache import ParsedPromptTemplate
+from app.services.tenant_prompt_service import embed_query, search_vectors_by_embedding
 from app.core.config import settings
+from app.core.prompt import (SUMMARY_REDUCE_PROMPT_TEMPLATE, SUMMARY_SEGMENT_PROMPT_TEMPLATE,
+                             SUMMARY_UPDATE_PROMPT_TEMPLATE)
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
-CHAT_COMPLETION_MODEL = settings.CHAT_COMPLETION_MODEL
-API_BASE_URL = "https://flashresponse.net/chat/api/v1/chats"
-HANDOVER_ENDPOINT = f"{API_BASE_URL}/handover"
+HANDOVER_ENDPOINT = settings.HANDOVER_ENDPOINT
+HANDOVER_QUEUE = settings.HANDOVER_QUEUE
+SEMANTIC_CACHE_ENABLED = settings.SEMANTIC_CACHE_ENABLED
+HEDGE_COMPLETIONS = settings.HEDGE_COMPLETIONS
+SUMMARY_INCREMENTAL = settings.SUMMARY_INCREMENTAL
+SUMMARY_MAP_REDUCE_THRESHOLD_TOKENS = settings.SUMMARY_MAP_REDUCE_THRESHOLD_TOKENS
+
+# Pooled HTTP client and circuit breaker for the fallback handover API
+http_client = httpx.AsyncClient(
+    timeout=settings.HANDOVER_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_connections=settings.HANDOVER_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.HANDOVER_HTTP_MAX_CONNECTIONS)
+)
+handover_breaker = CircuitBreaker(
+    "handover_api",
+    failure_threshold=settings.HANDOVER_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.HANDOVER_BREAKER_RESET_SECONDS
+)
 
 # Initialize connection to Milvus
 connections.connect("default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
@@ -48,11 +74,8 @@ handover_function = {
 }
 
 
-def trigger_handover(session_id: str, customer_id: str, tenant_id: str, summary: str, reason: str = "") -> bool:
-    """
-    Triggers the handover to a human agent via the RESTful API.
-    """
-    payload = {
+def build_handover_payload(session_id: str, customer_id: str, tenant_id: str, summary: str, reason: str = "") -> dict:
+    return {
         "session_id": session_id,
         "customer_id": customer_id,
         "tenant_id": tenant_id,
@@ -60,13 +83,20 @@ def trigger_handover(session_id: str, customer_id: str, tenant_id: str, summary:
         "reason": reason
     }
 
+
+async def trigger_handover(session_id: str, customer_id: str, tenant_id: str, summary: str, reason: str = "") -> bool:
+    """
+    Triggers the handover to a human agent via the RESTful API.
+    """
+    payload = build_handover_payload(session_id, customer_id, tenant_id, summary, reason)
+
     headers = {
         "Content-Type": "application/json",
         #"Authorization": f"Bearer {API_KEY}"
     }
 
     try:
-        response = requests.post(HANDOVER_ENDPOINT, json=payload, headers=headers)
+        response = await http_client.post(HANDOVER_ENDPOINT, json=payload, headers=headers)
         logging.info(f"posting to {HANDOVER_ENDPOINT} with data {payload}")
         if response.status_code == 202:
             logging.info("Handover to human agent initiated successfully.")
@@ -80,39 +110,183 @@ def trigger_handover(session_id: str, customer_id: str, tenant_id: str, summary:
         return False
 
 
-def trigger_handover_with_retry(session_id, customer_id, tenant_id, summary, reason, retries=3, delay=2):
+async def trigger_handover_with_retry(session_id, customer_id, tenant_id, summary, reason,
+                                      retries=settings.HANDOVER_HTTP_RETRIES,
+                                      base_delay=settings.HANDOVER_BACKOFF_BASE_SECONDS,
+                                      max_delay=settings.HANDOVER_BACKOFF_MAX_SECONDS):
     """
-    Implements a retry mechanism for the handover API call.
+    Retries the handover API call with exponential backoff and full jitter.
+    Calls are skipped entirely while the circuit breaker is open.
     """
     for attempt in range(retries):
-        success = trigger_handover(session_id, customer_id, tenant_id, summary, reason)
+        if not handover_breaker.allow():
+            logging.warning("Handover API circuit is open, skipping HTTP handover.")
+            break
+        success = await trigger_handover(session_id, customer_id, tenant_id, summary, reason)
         if success:
+            handover_breaker.record_success()
             return True
-        else:
-            logging.warning(f"Handover attempt {attempt + 1} failed. Retrying in {delay} seconds...")
-            time.sleep(delay)
+        handover_breaker.record_failure()
+        if attempt < retries - 1:
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logging.warning(f"Handover attempt {attempt + 1} failed. Retrying in {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
     logging.error("All handover attempts failed.")
     return False
 
 
+async def dispatch_handover(session_id, customer_id, tenant_id, summary, reason) -> bool:
+    """
+    Hands the session over to a human agent.
+
+    The handover event is published as a durable message to the handover queue and counts as
+    delivered once the broker confirms it; the HTTP API is only used if that publish fails.
+    """
+    payload = build_handover_payload(session_id, customer_id, tenant_id, summary, reason)
+    try:
+        await asyncio.wait_for(publisher.publish(HANDOVER_QUEUE, payload, wait_for_confirm=True),
+                               timeout=settings.HANDOVER_PUBLISH_TIMEOUT_SECONDS)
+        logging.info(f"Handover for session {session_id} published to {HANDOVER_QUEUE}")
+        HANDOVERS_TRIGGERED.labels(outcome="broker").inc()
+        return True
+    except Exception as e:
+        logging.error(f"Publishing handover to {HANDOVER_QUEUE} failed, falling back to HTTP: {e}")
+
+    if await trigger_handover_with_retry(session_id, customer_id, tenant_id, summary, reason):
+        HANDOVERS_TRIGGERED.labels(outcome="http").inc()
+        return True
+    HANDOVERS_TRIGGERED.labels(outcome="failure").inc()
+    return False
+
+
+
+async def _handover(trace: PipelineTrace, allow_handover: bool, **kwargs) -> bool:
+    if not allow_handover:
+        # Evaluation runs only record that the reply would have been handed over
+        logging.info(f"Handover not dispatched for tenant {kwargs['tenant_id']}: {kwargs['reason']}")
+        trace.handover = True
+        return True
+    handover_success = await trace.timed("handover", dispatch_handover(**kwargs))
+    trace.handover = handover_success
+    return handover_success
+
+
+async def _await_language(language_task: asyncio.Task) -> str:
+    try:
+        return await language_task
+    except Exception as e:
+        logging.error(f"Error detecting language: {e}")
+        STAGE_ERRORS.labels(stage="language").inc()
+        return "zh-tw"
+
 
-def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, session_id: str, customer_id: str) -> Union[dict, str]:
+async def create_chat_completion(tenant_id: Optional[str], operation: str,
+                                 on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                                 backend: Optional[CompletionBackend] = None, trace: Optional[PipelineTrace] = None,
+                                 on_latency: Optional[Callable[[float], None]] = None,
+                                 timeout: Optional[float] = None, **kwargs) -> ChatCompletion:
+    """
+    Calls a completion backend (by default the primary one) within the token budget of the
+    tenant (and of the whole OpenAI key), waiting for budget if needed, and under the adaptive
+    concurrency limit of the operation on that backend. Streams to on_delta when given; the
+    limiter then samples the time to the first token rather than the length of the reply.
+    timeout replaces the backend's own timeout, e.g. for summaries of long histories.
+
+    Time spent waiting for budget is added to trace's "budget_wait" timing. on_latency is called
+    with the duration of the backend call alone, also when it fails or is cancelled.
+    """
+    backend = backend or completion_backends.primary
+    estimate = token_budget.estimate_chat(kwargs["messages"], kwargs.get("max_tokens"))
+    async with token_budget.reserve(tenant_id, estimate) as reservation:
+        if trace is not None and reservation.waited:
+            trace.stage_timings["budget_wait"] = (trace.stage_timings.get("budget_wait", 0.0)
+                                                  + round(reservation.waited * 1000, 2))
+        async with chat_limiters.get(operation, backend.name).slot() as slot:
+            started = time.monotonic()
+            try:
+                if on_delta:
+                    async def first_token(delta: str):
+                        slot.first_response()
+                        await on_delta(delta)
+                    response = await backend.run(first_token, timeout, **kwargs)
+                else:
+                    response = await backend.run(timeout=timeout, **kwargs)
+            finally:
+                if on_latency is not None:
+                    on_latency(time.monotonic() - started)
+        reservation.settle(response.usage)
+    return response
+
+
+async def rag_pipeline(query_string: str, tenant_id: str, prompt_template: Union[str, ParsedPromptTemplate],
+                       session_id: str, customer_id: str,
+                       on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                       trace: Optional[PipelineTrace] = None, query_embedding: Optional[list] = None,
+                       relevant_docs: Optional[list] = None, allow_handover: bool = True,
+                       cache_answers: bool = True, cache_generation: Optional[int] = None) -> Union[ChatCompletion, str]:
     """
     Handles the RAG pipeline with integrated function calling for handover.
     Returns either a ChatCompletion object or a string.
+
+    When on_delta is given the completion is streamed and on_delta is awaited with each
+    content fragment; the assembled ChatCompletion is still returned at the end.
+    Stage timings are recorded on trace, if given. Batch callers may pass the query embedding
+    and retrieved documents they already fetched, which skips those stages, along with the
+    semantic cache generation read before they were fetched.
+    With allow_handover=False no handover is dispatched (trace.handover is still set), and with
+    cache_answers=False the answer is not stored in the semantic cache.
     """
-    # Detect the language of the query
-    detected_lang = detect_language(query_string)
+    trace = trace if trace is not None else PipelineTrace()
+    with trace.stage("total"):
+        return await _run_rag_pipeline(query_string, tenant_id, prompt_template, session_id, customer_id,
+                                       on_delta, trace, query_embedding, relevant_docs, allow_handover,
+                                       cache_answers, cache_generation)
+
+
+async def _run_rag_pipeline(query_string: str, tenant_id: str, prompt_template: Union[str, ParsedPromptTemplate],
+                            session_id: str,
+                            customer_id: str, on_delta: Optional[Callable[[str], Awaitable[None]]],
+                            trace: PipelineTrace, query_embedding: Optional[list],
+                            relevant_docs: Optional[list], allow_handover: bool, cache_answers: bool,
+                            cache_generation: Optional[int]) -> Union[ChatCompletion, str]:
+    # Language detection does not depend on retrieval: run it alongside the embedding/search stages
+    language_task = asyncio.create_task(trace.timed("language", run_blocking(detect_language, query_string)))
+    if cache_generation is None:
+        cache_generation = semantic_cache.generation(tenant_id)
+
+    if query_embedding is None:
+        try:
+            query_embedding = await trace.timed("embedding", embed_query(query_string))
+        except Exception as e:
+            logging.error(f"Error generating query embedding: {e}")
+            STAGE_ERRORS.labels(stage="embedding").inc()
+
+    # Answer near-duplicate questions from the tenant's semantic cache
+    if SEMANTIC_CACHE_ENABLED and query_embedding is not None:
+        detected_lang = await _await_language(language_task)
+        with trace.stage("cache_lookup"):
+            cached_answer = semantic_cache.lookup(tenant_id, query_embedding, detected_lang)
+        if cached_answer is not None:
+            trace.cache_hit = True
+            if on_delta:
+                await on_delta(cached_answer)
+            # Zero usage: no LLM tokens were spent on this reply
+            return build_completion(cached_answer, None)
 
     # Retrieve relevant documents from the vector database using vector search
-    relevant_docs = search_vectors_in_tenant_db(query_string, tenant_id=tenant_id)
+    if relevant_docs is None:
+        relevant_docs = []
+        if query_embedding is not None:
+            relevant_docs = await trace.timed("retrieval", search_vectors_by_embedding(query_embedding, tenant_id=tenant_id))
+    detected_lang = await _await_language(language_task)
 
-    # Combine retrieved documents into a context string
-    context = "\n".join(relevant_docs)
-    logging.info("Retrieved context: \n" + context)
+    with trace.stage("prompt"):
+        # Combine retrieved documents into a context string
+        context = "\n".join(relevant_docs)
+        logging.info("Retrieved context: \n" + context)
 
-    # Construct the final prompt by combining template and query data
-    prompt = prompt_template.format(document=context, language=detected_lang, question=query_string)
+        # Construct the final prompt by combining template and query data
+        prompt = prompt_template.format(document=context, language=detected_lang, question=query_string)
 
     # Define messages for the AI
     messages = [
@@ -120,21 +294,56 @@ def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, sessio
         {"role": "user", "content": query_string},
     ]
 
+    # Call the completion backends to generate the response with function definitions
+    completion_args = dict(
+        messages=messages,
+        functions=[handover_function],
+        function_call="auto",  # Let the AI decide whether to call the function
+        temperature=0
+    )
+    streamed = False
+
+    async def forward_delta(delta: str):
+        nonlocal streamed
+        streamed = True
+        await on_delta(delta)
+
+    async def complete_with(backend: CompletionBackend) -> ChatCompletion:
+        response = await create_chat_completion(tenant_id, "rag", forward_delta if on_delta else None, backend=backend,
+                                                trace=trace, on_latency=None if on_delta else completion_hedger.observe,
+                                                **completion_args)
+        trace.completion_backend = backend.name
+        return response
+
+    async def complete() -> ChatCompletion:
+        # Fall through the backend tiers, unless part of a streamed reply already went out
+        return await completion_backends.complete(complete_with, can_fall_through=lambda: not streamed)
+
     try:
-        # Call OpenAI GPT to generate the response with function definitions
-        response = client.chat.completions.create(
-            model=CHAT_COMPLETION_MODEL,
-            messages=messages,
-            functions=[handover_function],
-            function_call="auto",  # Let the AI decide whether to call the function
-            temperature=0
-        )
+        with trace.stage("completion"), CHAT_COMPLETION_LATENCY.labels(operation="rag").time():
+            if HEDGE_COMPLETIONS and not on_delta:
+                # Streamed replies are already on their way to the customer and are never hedged
+                response = await completion_hedger.run(
+                    tenant_id,
+                    complete,
+                    cost=lambda: token_budget.estimate_chat(messages),
+                    trace=trace,
+                    # A hedge would only add load while calls queue for budget or for a slot
+                    can_hedge=lambda: ("budget_wait" not in trace.stage_timings
+                                       and not chat_limiters.get("rag", completion_backends.primary.name).waiting)
+                )
+            else:
+                response = await complete()
     except Exception as e:
+        # Every completion backend failed
         logging.error(f"Error during OpenAI API call: {e}")
+        STAGE_ERRORS.labels(stage="completion").inc()
         # Trigger handover due to API failure
         summary = f"Session ID: {session_id}\nCustomer ID: {customer_id}\nLast Query: {query_string}\nAI Response: None due to OpenAI API failure."
         reason = "OpenAI API failure."
-        handover_success = trigger_handover_with_retry(
+        handover_success = await _handover(
+            trace,
+            allow_handover,
             session_id=session_id,
             customer_id=customer_id,
             tenant_id=tenant_id,
@@ -164,7 +373,9 @@ def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, sessio
                 reason = "Invalid function arguments."
 
             # Append the missing parameters and trigger the handover
-            handover_success = trigger_handover_with_retry(
+            handover_success = await _handover(
+                trace,
+                allow_handover,
                 session_id=session_id,
                 customer_id=customer_id,
                 tenant_id=tenant_id,
@@ -182,6 +393,9 @@ def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, sessio
 
     elif choice.message.content:
         # If the AI provided a regular response, return it as is
+        if SEMANTIC_CACHE_ENABLED and cache_answers and query_embedding is not None:
+            semantic_cache.store(tenant_id, query_string, query_embedding, detected_lang,
+                                 choice.message.content, cache_generation)
         return response  # Return the original ChatCompletion object
 
     else:
@@ -189,7 +403,9 @@ def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, sessio
         summary = f"Session ID: {session_id}\nCustomer ID: {customer_id}\nLast Query: {query_string}\nAI Response: None"
         reason = "No response generated by AI."
 
-        handover_success = trigger_handover_with_retry(
+        handover_success = await _handover(
+            trace,
+            allow_handover,
             session_id=session_id,
             customer_id=customer_id,
             tenant_id=tenant_id,
@@ -203,20 +419,100 @@ def rag_pipeline(query_string: str, tenant_id: str, prompt_template: str, sessio
         else:
             return "I'm experiencing some issues connecting you to a human agent. Please try again later."
 
-def summarize(tenant_id: str, prompt_template: str, customer_id: str) -> ChatCompletion | str:
-    # Get chat history from session (in redis)
-    chat_history = get_formatted_chat_history(customer_id, tenant_id)
-    logging.info("chat history:" + chat_history)
-    # Summary with LLM
-    prompt = prompt_template.format(history = chat_history)
-    logging.info("prompt:" + prompt)
-    messages = [
-        {"role": "system", "content": prompt},
-    ]
-    response = client.chat.completions.create(model=CHAT_COMPLETION_MODEL,
-                                              messages=messages, temperature=0)
+async def summarize(tenant_id: str, prompt_template: str, customer_id: str,
+                    update_prompt_template: str = SUMMARY_UPDATE_PROMPT_TEMPLATE) -> ChatCompletion | str:
+    """
+    Summarizes the customer's current session.
+
+    The last summary is stored in Redis with the index of the first message it does not cover,
+    so a later request only sends that summary plus the newer messages to the LLM. If nothing
+    was added since, the stored summary is returned without an LLM call.
+    """
+    # Get chat history from session (in redis), starting after the stored summary if there is one
+    window = await chat_history.get_window(customer_id, tenant_id, with_summary=SUMMARY_INCREMENTAL)
+    return await summarize_window(tenant_id, window, prompt_template, update_prompt_template)
+
+
+async def summarize_window(tenant_id: str, window: ChatHistoryWindow, prompt_template: str,
+                           update_prompt_template: str = SUMMARY_UPDATE_PROMPT_TEMPLATE) -> ChatCompletion | str:
+    """
+    Summarizes an already fetched chat history window (see summarize).
+    Histories longer than SUMMARY_MAP_REDUCE_THRESHOLD_TOKENS are summarized map-reduce style.
+    """
+    history = window.format()
+    logging.info("chat history:" + history)
+    if window.summary is not None and not window.messages:
+        logging.info(f"No new messages in session {window.session_id}, returning the stored summary")
+        return build_completion(window.summary, None)
+    if window.summary is None and not window.messages:
+        raise ValueError(f"No chat history found for session {window.session_id}.")
+
+    if chat_history.count_tokens(history) > SUMMARY_MAP_REDUCE_THRESHOLD_TOKENS:
+        response = await map_reduce_summarize(tenant_id, window)
+    else:
+        if window.summary is not None:
+            prompt = update_prompt_template.format(summary=window.summary, history=history)
+        else:
+            prompt = prompt_template.format(history=history)
+
+        # Summary with LLM
+        logging.info("prompt:" + prompt)
+        messages = [
+            {"role": "system", "content": prompt},
+        ]
+        with CHAT_COMPLETION_LATENCY.labels(operation="summary").time():
+            response = await create_chat_completion(tenant_id, "summary",
+                                                    timeout=settings.SUMMARY_COMPLETION_TIMEOUT_SECONDS,
+                                                    messages=messages, temperature=0)
 
     if response.choices:
+        if SUMMARY_INCREMENTAL and response.choices[0].message.content:
+            await chat_history.save_summary(tenant_id, window.session_id,
+                                            response.choices[0].message.content, window.end)
         return response
     else:
         return None;
+
+
+def _total_usage(responses) -> CompletionUsage:
+    usages = [response.usage for response in responses if response.usage]
+    return CompletionUsage(
+        prompt_tokens=sum(usage.prompt_tokens for usage in usages),
+        completion_tokens=sum(usage.completion_tokens for usage in usages),
+        total_tokens=sum(usage.total_tokens for usage in usages)
+    )
+
+
+async def map_reduce_summarize(tenant_id: str, window: ChatHistoryWindow) -> ChatCompletion:
+    """
+    Summarizes a long history in token-bounded segments, in parallel, then combines the partial
+    summaries (and the previous summary, if any) in a final call. The returned completion
+    carries the token usage of all calls.
+    """
+    segments = chat_history.segment(window, settings.SUMMARY_SEGMENT_TOKENS)
+    logging.info(f"Summarizing session {window.session_id} in {len(segments)} segments")
+    semaphore = asyncio.Semaphore(settings.SUMMARY_MAP_CONCURRENCY)
+
+    async def summarize_segment(part: int, segment: str) -> ChatCompletion:
+        prompt = SUMMARY_SEGMENT_PROMPT_TEMPLATE.format(part=part, parts=len(segments), history=segment)
+        async with semaphore:
+            with CHAT_COMPLETION_LATENCY.labels(operation="summary_map").time():
+                return await create_chat_completion(tenant_id, "summary_map",
+                                                    timeout=settings.SUMMARY_COMPLETION_TIMEOUT_SECONDS,
+                                                    messages=[{"role": "system", "content": prompt}],
+                                                    temperature=0)
+
+    partials = await asyncio.gather(*[summarize_segment(part, segment)
+                                      for part, segment in enumerate(segments, start=1)])
+
+    partial_summaries = "\n\n".join(f"[{part}]\n{partial.choices[0].message.content}"
+                                     for part, partial in enumerate(partials, start=1))
+    prompt = SUMMARY_REDUCE_PROMPT_TEMPLATE.format(summary=window.summary or "(none)", partials=partial_summaries)
+    with CHAT_COMPLETION_LATENCY.labels(operation="summary_reduce").time():
+        response = await create_chat_completion(tenant_id, "summary_reduce",
+                                                timeout=settings.SUMMARY_COMPLETION_TIMEOUT_SECONDS,
+                                                messages=[{"role": "system", "content": prompt}],
+                                                temperature=0)
+
+    response.usage = _total_usage([*partials, response])
+    return response
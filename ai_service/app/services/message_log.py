@@ -0,0 +1,64 @@
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Optional
+
+
+class ReceivedMessageLog:
+    """
+    Fixed-capacity ring buffer of the most recently received messages.
+
+    Every message gets a sequence number, which serves as the pagination cursor: page(cursor)
+    returns messages received after it, oldest first. Aggregate counters are kept apart from
+    the buffer, so they cover all messages, including those already overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = deque(maxlen=capacity)
+        self.total = 0
+        self.per_tenant: Dict[str, int] = {}
+        self.last_received_at: Optional[float] = None
+
+    def append(self, message: Any):
+        self.total += 1
+        self._buffer.append((self.total, message))
+        self.per_tenant[message.tenant_id] = self.per_tenant.get(message.tenant_id, 0) + 1
+        self.last_received_at = time.time()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def page(self, cursor: int = 0, limit: int = 50,
+             tenant_id: Optional[str] = None, session_id: Optional[str] = None) -> dict:
+        """
+        Returns up to limit buffered messages with a sequence number greater than cursor,
+        optionally filtered by tenant and session, plus the cursor for the next page.
+        """
+        oldest = self.total - len(self._buffer) + 1
+        start = max(0, cursor - oldest + 1)
+
+        items = []
+        next_cursor = cursor
+        for seq, message in islice(self._buffer, start, None):
+            next_cursor = seq
+            if tenant_id is not None and message.tenant_id != tenant_id:
+                continue
+            if session_id is not None and message.session_id != session_id:
+                continue
+            items.append({"seq": seq, "message": message})
+            if len(items) >= limit:
+                break
+
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor < self.total,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "message_count": self.total,
+            "buffered": len(self._buffer),
+            "tenants": len(self.per_tenant),
+            "last_received_at": self.last_received_at,
+        }
@@ -1,17 +1,26 @@
+import asyncio
+import logging
+
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List, Set
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 
 from app.core.config import settings
+from app.core.metrics import STAGE_ERRORS
 from app.schemas.ai_reply import AIReply
 
+logger = logging.getLogger(__name__)
+
 
 class MongoDBService:
     def __init__(self):
         self.client = AsyncIOMotorClient(settings.MONGODB_URL)
         self.db = self.client[settings.DATABASE_NAME]
+        # Tenants whose collection indexes were already created by this process
+        self._indexed_tenants: Set[str] = set()
 
     async def get_tenant_collection(self, tenant_id: str):
         collection_name = f"{tenant_id}_replies"
@@ -32,14 +41,113 @@ class MongoDBService:
 
     async def ensure_indexes(self, tenant_ids: List[str]):
         for tenant_id in tenant_ids:
-            collection = await self.get_tenant_collection(tenant_id)
-            await collection.create_index("created_at")
+            await self.ensure_index(tenant_id)
 
     async def ensure_index(self, tenant_id: str):
+        if tenant_id in self._indexed_tenants:
+            return
         collection = await self.get_tenant_collection(tenant_id)
         await collection.create_index("created_at")
+        self._indexed_tenants.add(tenant_id)
+
+    async def insert_ai_replies(self, tenant_id: str, documents: List[dict]):
+        await self.ensure_index(tenant_id)
+        collection = await self.get_tenant_collection(tenant_id)
+        await collection.insert_many(documents, ordered=False)
 
     async def close_connection(self):
         self.client.close()
 
-mongodb_service = MongoDBService()
\ No newline at end of file
+class AIReplyWriter:
+    """
+    Write-behind buffer for AIReply documents.
+
+    Replies are queued per tenant collection and written with insert_many once max_batch are
+    waiting for a tenant, or every flush_interval seconds. The document id is assigned on
+    add(), so callers get it back without waiting for the write. A failed write is retried
+    up to max_retries times with exponential backoff, for the documents not yet written.
+    """
+
+    def __init__(self, service: MongoDBService, max_batch: int, flush_interval: float,
+                 max_retries: int = 3, retry_backoff: float = 1.0):
+        self.service = service
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._buffers: Dict[str, List[dict]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    def add(self, ai_reply: AIReply) -> str:
+        document = ai_reply.dict()
+        document["_id"] = ObjectId()
+        buffer = self._buffers.setdefault(ai_reply.tenant_id, [])
+        buffer.append(document)
+        if len(buffer) >= self.max_batch:
+            self._write_tenant(ai_reply.tenant_id)
+        return str(document["_id"])
+
+    def _write_tenant(self, tenant_id: str):
+        documents = self._buffers.pop(tenant_id, None)
+        if not documents:
+            return
+        task = asyncio.create_task(self._write(tenant_id, documents))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, tenant_id: str, documents: List[dict]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.service.insert_ai_replies(tenant_id, documents)
+                return
+            except BulkWriteError as e:
+                # Unordered insert: keep only the documents that failed, except duplicate ids,
+                # which an earlier attempt already wrote
+                failed = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000}
+                documents = [document for index, document in enumerate(documents) if index in failed]
+                if not documents:
+                    return
+                error = e
+            except Exception as e:
+                error = e
+
+            STAGE_ERRORS.labels(stage="persist").inc()
+            if attempt < self.max_retries:
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"Writing {len(documents)} AI replies for tenant {tenant_id} failed "
+                               f"({error}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"Writing {len(documents)} AI replies for tenant {tenant_id} failed "
+                             f"after {self.max_retries + 1} attempts, dropping them: {error}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        for tenant_id in list(self._buffers):
+            self._write_tenant(tenant_id)
+        if self._writes:
+            await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+
+mongodb_service = MongoDBService()
+reply_writer = AIReplyWriter(
+    mongodb_service,
+    max_batch=settings.AI_REPLY_WRITE_BATCH_SIZE,
+    flush_interval=settings.AI_REPLY_FLUSH_INTERVAL_SECONDS,
+    max_retries=settings.AI_REPLY_WRITE_RETRIES,
+    retry_backoff=settings.AI_REPLY_RETRY_BACKOFF_SECONDS
+)
@@ -0,0 +1,42 @@
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class PipelineTrace:
+    """
+    Per-reply record of how the RAG pipeline ran: wall time of each stage in milliseconds
+    and whether the answer came from the semantic cache. Copied onto the AIReply document.
+    Also notes whether the session was handed over to a human agent, and whether the completion
+    was hedged and the hedge answered first, and which completion backend answered.
+    """
+
+    def __init__(self):
+        self.stage_timings: Dict[str, float] = {}
+        self.cache_hit = False
+        self.handover = False
+        self.hedged = False
+        self.hedge_won = False
+        self.completion_backend: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.stage(name):
+            return await awaitable
+
+    def apply(self, ai_reply):
+        ai_reply.stage_timings = dict(self.stage_timings)
+        ai_reply.cache_hit = self.cache_hit
+        ai_reply.hedged = self.hedged
+        ai_reply.hedge_won = self.hedge_won
+        ai_reply.completion_backend = self.completion_backend
+        return ai_reply
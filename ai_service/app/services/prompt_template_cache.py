@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import logging
+import time
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.prompt import RAG_PROMPT_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedPromptTemplate:
+    """
+    A prompt template split once into literal text and {document}/{language}/{question} slots.
+
+    format() only joins strings. Any other placeholder, and doubled braces, are kept as
+    literal text, so tenant-written templates cannot raise KeyError at message time.
+    """
+
+    SLOTS = ("document", "language", "question")
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if field_name in self.SLOTS:
+                self._parts.append((literal, field_name))
+            elif field_name is not None:
+                placeholder = field_name + (f"!{conversion}" if conversion else "") + (f":{format_spec}" if format_spec else "")
+                self._parts.append((literal + "{" + placeholder + "}", None))
+            else:
+                self._parts.append((literal, None))
+
+    def format(self, **values: str) -> str:
+        return "".join(literal + (values.get(slot, "") if slot else "") for literal, slot in self._parts)
+
+
+DEFAULT_RAG_TEMPLATE = ParsedPromptTemplate(RAG_PROMPT_TEMPLATE)
+
+
+def parse_template(template: str) -> ParsedPromptTemplate:
+    try:
+        return ParsedPromptTemplate(template)
+    except ValueError as e:
+        # Unbalanced braces and the like: keep serving the default rather than failing messages
+        logger.error(f"Invalid prompt template, using the default one: {e}")
+        return DEFAULT_RAG_TEMPLATE
+
+
+class TenantPromptTemplateCache:
+    """
+    Per-tenant cache of parsed RAG prompt templates.
+
+    Entries expire after ttl seconds and are dropped by invalidate() when a tenant's templates
+    change. Concurrent misses for the same tenant share one database lookup. Tenants without
+    a template of their own get the default RAG_PROMPT_TEMPLATE.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, ParsedPromptTemplate]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, tenant_id: str) -> ParsedPromptTemplate:
+        entry = self._entries.get(tenant_id)
+        if entry and time.monotonic() < entry[0]:
+            return entry[1]
+
+        loading = self._loading.get(tenant_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(tenant_id))
+            self._loading[tenant_id] = loading
+            loading.add_done_callback(functools.partial(self._loaded, tenant_id))
+        return await asyncio.shield(loading)
+
+    def _loaded(self, tenant_id: str, loading: asyncio.Future):
+        if self._loading.get(tenant_id) is loading:
+            del self._loading[tenant_id]
+
+    async def _load(self, tenant_id: str) -> ParsedPromptTemplate:
+        from app.services.tenant_prompt_service import get_rag_template  # avoids an import cycle
+
+        version = self._versions.get(tenant_id, 0)
+        try:
+            async with SessionLocal() as db:
+                template = await get_rag_template(db, tenant_id)
+        except Exception as e:
+            logger.error(f"Loading prompt template for tenant {tenant_id} failed, using the default one: {e}")
+            return DEFAULT_RAG_TEMPLATE
+
+        parsed = parse_template(template.prompt_template) if template else DEFAULT_RAG_TEMPLATE
+        # Do not cache what was read before a concurrent invalidate()
+        if self._versions.get(tenant_id, 0) == version:
+            self._entries[tenant_id] = (time.monotonic() + self.ttl, parsed)
+        return parsed
+
+    def invalidate(self, tenant_id: str):
+        self._versions[tenant_id] = self._versions.get(tenant_id, 0) + 1
+        self._entries.pop(tenant_id, None)
+        self._loading.pop(tenant_id, None)
+        logger.info(f"Prompt template cache invalidated for tenant {tenant_id}")
+
+    def invalidate_all(self):
+        for tenant_id in set(self._entries) | set(self._loading):
+            self._versions[tenant_id] = self._versions.get(tenant_id, 0) + 1
+        self._entries.clear()
+        self._loading.clear()
+        logger.info("Prompt template cache invalidated for all tenants")
+
+
+prompt_templates = TenantPromptTemplateCache(ttl=settings.PROMPT_TEMPLATE_CACHE_TTL_SECONDS)
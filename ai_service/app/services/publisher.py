@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from functools import partial
+from typing import Dict, List, Set, Union
+
+from aio_pika import DeliveryMode, Message
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RabbitPublisher:
+    """
+    Publishes persistent messages to the default exchange over a small pool of channels.
+
+    - Queues already declared by this process are remembered for declare_ttl seconds,
+      so the declare round trip is paid once per queue rather than once per message.
+    - All messages for one routing key go through the same channel, which keeps their order
+      (ACKNOWLEDGEMENT before CHAT, stream chunks in sequence).
+    - With publisher confirms enabled, publishes do not wait for their own confirm; confirms
+      are awaited together once confirm_batch_size are outstanding, or on flush(). A publish
+      that does wait for its confirm is held back until the background publishes to the same
+      routing key went out, so it keeps its place in line (CHAT_END after the last chunk).
+    """
+
+    def __init__(self, pool_size: int, declare_ttl: int, confirms: bool, confirm_batch_size: int):
+        self.pool_size = pool_size
+        self.declare_ttl = declare_ttl
+        self.confirms = confirms
+        self.confirm_batch_size = confirm_batch_size
+        self._channels: List[AbstractChannel] = []
+        self._declared: Dict[str, float] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self._last: Dict[str, asyncio.Task] = {}
+
+    async def start(self, connection: AbstractRobustConnection):
+        for _ in range(self.pool_size):
+            self._channels.append(await connection.channel(publisher_confirms=self.confirms))
+        logger.info(f"[*] Publisher started with {self.pool_size} channels (confirms={self.confirms})")
+
+    async def close(self):
+        await self.flush()
+        for channel in self._channels:
+            await channel.close()
+        self._channels.clear()
+
+    def _channel_for(self, routing_key: str) -> AbstractChannel:
+        return self._channels[zlib.crc32(routing_key.encode()) % len(self._channels)]
+
+    async def _ensure_queue(self, channel: AbstractChannel, queue_name: str):
+        declared_at = self._declared.get(queue_name)
+        if declared_at is not None and time.monotonic() - declared_at < self.declare_ttl:
+            return
+        await channel.declare_queue(queue_name, durable=True)
+        self._declared[queue_name] = time.monotonic()
+
+    def forget_queue(self, queue_name: str):
+        self._declared.pop(queue_name, None)
+
+    async def publish(self, queue_name: str, body: Union[dict, bytes], wait_for_confirm: bool = False):
+        """
+        Publishes body (a dict is JSON-encoded) to the named durable queue via the default exchange.
+        """
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+
+        channel = self._channel_for(queue_name)
+        await self._ensure_queue(channel, queue_name)
+
+        publish = channel.default_exchange.publish(
+            Message(body=body, content_type="application/json", delivery_mode=DeliveryMode.PERSISTENT),
+            routing_key=queue_name  # Routing key is the queue name
+        )
+        if not self.confirms or wait_for_confirm:
+            previous = self._last.get(queue_name)
+            if previous is not None:
+                await asyncio.wait({previous})
+            await publish
+            return
+
+        task = asyncio.create_task(publish)
+        self._pending.add(task)
+        self._last[queue_name] = task
+        task.add_done_callback(partial(self._on_confirmed, queue_name))
+        if len(self._pending) >= self.confirm_batch_size:
+            await self.flush()
+
+    def _on_confirmed(self, queue_name: str, task: asyncio.Task):
+        self._pending.discard(task)
+        if self._last.get(queue_name) is task:
+            del self._last[queue_name]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"[!] Publish was not confirmed by the broker: {task.exception()}")
+
+    async def flush(self):
+        """
+        Waits for every outstanding publisher confirm.
+        """
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+
+publisher = RabbitPublisher(
+    pool_size=settings.PUBLISHER_CHANNEL_POOL_SIZE,
+    declare_ttl=settings.PUBLISHER_DECLARE_CACHE_TTL_SECONDS,
+    confirms=settings.PUBLISHER_CONFIRMS,
+    confirm_batch_size=settings.PUBLISHER_CONFIRM_BATCH_SIZE
+)
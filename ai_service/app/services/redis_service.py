@@ -1,104 +1,219 @@
 import logging
+from typing import Iterator, List, Optional, Tuple
 
-import redis
-import json
-
+import orjson
+import tiktoken
 
 from app.core.config import settings
-
-# ==============================
-# Initialize Redis Client Once
-# ==============================
-
-try:
-    redis_client = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        password=settings.REDIS_PASSWORD,
-        decode_responses=True  # Automatically decode bytes to strings
-    )
-
-    # Test the connection
-    if not redis_client.ping():
-        raise ConnectionError("Unable to connect to Redis.")
-except redis.AuthenticationError:
-    raise ValueError("Authentication failed when connecting to Redis.")
-except redis.ConnectionError:
-    raise ConnectionError("Could not connect to Redis. Please check the connection parameters.")
-except Exception as e:
-    raise Exception(f"An error occurred while connecting to Redis: {str(e)}")
-
-
-# ==============================
-# Service Method Implementation
-# ==============================
-
-def get_formatted_chat_history(
-        user_id: str,
-        tenant_id: str
-) -> str:
-    """
-    Retrieves and formats chat history for a given user_id from Redis.
-
-    Args:
-        user_id (str): The user ID to retrieve chat history for.
-        tenant_id (str): Tenant ID used in Redis keys. Default is 'tenant_72'.
-
-    Returns:
-        str: Formatted chat history as "sender: message" pairs separated by newlines.
-
-    Raises:
-        ValueError: If session ID or chat history is not found.
-        Exception: For other unexpected errors.
-    """
-
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Resolves the user's session and reads the requested tail of its chat list in one round trip.
+# KEYS[1]: user session key
+# ARGV: chat key prefix, summary key prefix ('' to skip), start index, last N messages (0 = all)
+# Returns {session_id, list length, start, summary or false, messages...} or false without a session.
+# The chat and summary keys are derived from the session id, so this assumes a non-clustered Redis.
+READ_WINDOW_SCRIPT = """
+local session_id = redis.call('GET', KEYS[1])
+if not session_id then
+    return false
+end
+session_id = (string.gsub(session_id, '"', ''))
+if session_id == '' then
+    return false
+end
+
+local chat_key = ARGV[1] .. session_id
+local length = redis.call('LLEN', chat_key)
+local start = tonumber(ARGV[3])
+local last_n = tonumber(ARGV[4])
+
+local summary = false
+if ARGV[2] ~= '' then
+    local state = redis.call('HMGET', ARGV[2] .. session_id, 'summary', 'last_index')
+    if state[1] and state[2] then
+        summary = state[1]
+        start = tonumber(state[2])
+    end
+end
+
+-- The list is shorter than where we left off: the session was reset
+if start > length then
+    start = 0
+    summary = false
+end
+if last_n > 0 and length - last_n > start then
+    start = length - last_n
+end
+
+local result = {session_id, length, start, summary}
+local messages = redis.call('LRANGE', chat_key, start, -1)
+for i = 1, #messages do
+    result[#result + 1] = messages[i]
+end
+return result
+"""
+
+
+def _encoding():
     try:
-        # Construct the key to retrieve session_id
-        session_key = f"tenant:{tenant_id}:user_session:{user_id}"
-
-        # Retrieve session_id from Redis
-        session_id = redis_client.get(session_key)
+        return tiktoken.encoding_for_model(settings.CHAT_COMPLETION_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
 
-        if session_id:  # Check if session_id is not None
-            session_id = session_id.replace('"', '')  # Remove double quotes
 
+class ChatHistoryWindow:
+    """
+    A contiguous slice [start, end) of a session's chat list, parsed into message dicts.
+    """
 
-        logging.info("session_id found while getting chat_history: " + session_id)
-        if not session_id:
-            raise ValueError("Session ID not found for the provided user_id.")
-
-        # Construct the key to retrieve chat history
-        chat_key = f"tenant:{tenant_id}:chat:customer_messages:{session_id}"
+    def __init__(self, session_id: str, length: int, start: int, messages: List[dict],
+                 summary: Optional[str] = None):
+        self.session_id = session_id
+        self.length = length
+        self.start = start
+        self.messages = messages
+        self.summary = summary
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.messages)
+
+    def lines(self) -> Iterator[str]:
+        for message in self.messages:
+            sender = message.get("sender")
+            content = message.get("content")
+            if sender and content:
+                yield f"{sender}: {content}"
+
+    def format(self) -> str:
+        """
+        Formats the window as "sender: message" lines.
+        """
+        return "\n".join(self.lines())
+
+
+class ChatHistoryRepository:
+    """
+    Async access to the chat history the platform service keeps in Redis.
 
-        # Retrieve chat history as a list from Redis
-        # Assuming the chat messages are stored as a Redis list
-        chat_messages = redis_client.lrange(chat_key, 0, -1)
-        if not chat_messages:
-            raise ValueError("No chat history found for the session." + chat_key)
+    Sessions are resolved and their messages fetched with a single Lua script call. Reads can
+    be bounded to the last N messages and/or to a token budget (oldest messages dropped first).
+    """
 
-        formatted_messages = []
-        for message_str in chat_messages:
+    def __init__(self, client):
+        self.client = client
+        self._read_window = client.register_script(READ_WINDOW_SCRIPT)
+        self._encoding = None
+
+    @staticmethod
+    def session_key(tenant_id: str, user_id: str) -> str:
+        return f"tenant:{tenant_id}:user_session:{user_id}"
+
+    @staticmethod
+    def chat_key_prefix(tenant_id: str) -> str:
+        return f"tenant:{tenant_id}:chat:customer_messages:"
+
+    @staticmethod
+    def summary_key_prefix(tenant_id: str) -> str:
+        return f"tenant:{tenant_id}:chat:summary:"
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is None:
+            self._encoding = _encoding()
+        return len(self._encoding.encode(text))
+
+    def segment(self, window: ChatHistoryWindow, max_tokens: int) -> List[str]:
+        """
+        Splits the formatted window into consecutive chunks of at most max_tokens tokens,
+        breaking only between messages (a single longer message becomes its own chunk).
+        """
+        segments = []
+        lines = []
+        used = 0
+        for line in window.lines():
+            tokens = self.count_tokens(line)
+            if lines and used + tokens > max_tokens:
+                segments.append("\n".join(lines))
+                lines, used = [], 0
+            lines.append(line)
+            used += tokens
+        if lines:
+            segments.append("\n".join(lines))
+        return segments
+
+    @staticmethod
+    def _parse(raw_messages: List[str]) -> Iterator[dict]:
+        for raw in raw_messages:
             try:
-                # Parse the JSON string into a Python dictionary
-                message = json.loads(message_str)
-
-                # Extract sender and content
-                sender = message.get("sender")
-                content = message.get("content")
-
-                if sender and content:
-                    formatted_messages.append(f"{sender}: {content}")
-
-            except json.JSONDecodeError:
-                # Handle invalid JSON formats
-                logging.error("Invalid message format.")
-
-        # Join all messages into a single string separated by newlines
-        return "\n".join(formatted_messages)
-
-    except ValueError as ve:
-        # Re-raise known value errors
-        raise ve
-    except Exception as e:
-        # Catch-all for unexpected errors
-        raise Exception(f"An error occurred while retrieving chat history: {str(e)}")
+                yield orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                logger.error("Invalid message format.")
+                yield {}
+
+    async def get_window(self, user_id: str, tenant_id: str, start: int = 0, last_n: Optional[int] = None,
+                         token_budget: Optional[int] = None, with_summary: bool = False) -> ChatHistoryWindow:
+        """
+        Reads the user's current session from index start onwards.
+
+        With with_summary, the stored session summary (if any) is returned on the window and
+        reading starts right after the messages it covers. Raises ValueError if the user has
+        no session.
+        """
+        result = await self._read_window(**self._window_call(user_id, tenant_id, start, last_n, with_summary))
+        if not result:
+            raise ValueError("Session ID not found for the provided user_id.")
+        return self._to_window(result, token_budget)
+
+    async def get_windows(self, users: List[Tuple[str, str]], last_n: Optional[int] = None,
+                          token_budget: Optional[int] = None,
+                          with_summary: bool = False) -> List[Optional[ChatHistoryWindow]]:
+        """
+        Reads the current session of many (user_id, tenant_id) pairs in one pipeline.
+        Users without a session get None.
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, tenant_id in users:
+                await self._read_window(client=pipe, **self._window_call(user_id, tenant_id, 0, last_n, with_summary))
+            results = await pipe.execute()
+        return [self._to_window(result, token_budget) if result else None for result in results]
+
+    def _window_call(self, user_id: str, tenant_id: str, start: int, last_n: Optional[int],
+                     with_summary: bool) -> dict:
+        return {
+            "keys": [self.session_key(tenant_id, user_id)],
+            "args": [self.chat_key_prefix(tenant_id),
+                     self.summary_key_prefix(tenant_id) if with_summary else "",
+                     start, last_n or 0],
+        }
+
+    def _to_window(self, result: list, token_budget: Optional[int]) -> ChatHistoryWindow:
+        session_id, length, window_start, summary = result[0], int(result[1]), int(result[2]), result[3]
+        messages = list(self._parse(result[4:]))
+
+        if token_budget is not None:
+            kept = 0
+            used = 0
+            for message in reversed(messages):
+                used += self.count_tokens(f"{message.get('sender')}: {message.get('content') or ''}")
+                if used > token_budget:
+                    break
+                kept += 1
+            window_start += len(messages) - kept
+            messages = messages[len(messages) - kept:]
+
+        return ChatHistoryWindow(session_id, length, window_start, messages, summary or None)
+
+    async def save_summary(self, tenant_id: str, session_id: str, summary: str, last_index: int):
+        """
+        Stores a session summary with the index of the first message it does not cover.
+        """
+        key = self.summary_key_prefix(tenant_id) + session_id
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={"summary": summary, "last_index": last_index})
+            pipe.expire(key, settings.SUMMARY_STATE_TTL_SECONDS)
+            await pipe.execute()
+
+
+chat_history = ChatHistoryRepository(redis_client)
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+from aio_pika import connect_robust
+from aio_pika.abc import AbstractRobustConnection
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.services.knowledge_base_events import listen_for_knowledge_base_changes
+from app.services.llm_service import http_client
+from app.services.mongodb_service import mongodb_service, reply_writer
+from app.services.prompt_template_cache import prompt_templates
+from app.services.publisher import publisher
+from app.services.semantic_cache import semantic_cache
+from app.vector_db.collection_registry import collection_registry
+
+
+async def connect_rabbitmq() -> AbstractRobustConnection:
+    # Establish robust connection to RabbitMQ
+    return await connect_robust(
+        host=settings.RABBITMQ_HOST,
+        port=settings.RABBITMQ_PORT,
+        login=settings.RABBITMQ_USERNAME,
+        password=settings.RABBITMQ_PASSWORD,
+    )
+
+
+async def start_background_services(connection: AbstractRobustConnection) -> asyncio.Future:
+    """
+    Starts what both the API and the workers rely on and returns the cache listeners as one future.
+    """
+    # Drop cached templates (and the answers generated with them) when a tenant's templates change
+    template_listener = asyncio.create_task(listen_for_knowledge_base_changes(
+        redis_client, [prompt_templates.invalidate, semantic_cache.invalidate],
+        channel=settings.PROMPT_TEMPLATE_UPDATES_CHANNEL,
+        on_resubscribe=[prompt_templates.invalidate_all, semantic_cache.invalidate_all]
+    ))
+
+    # Replies go out through a separate pool of publishing channels
+    await publisher.start(connection)
+
+    # AI replies are written to Mongo in per-tenant batches
+    reply_writer.start()
+
+    # Drop cached answers and re-check collection handles whenever a tenant's knowledge base changes
+    knowledge_base_listener = asyncio.create_task(listen_for_knowledge_base_changes(
+        redis_client, [semantic_cache.invalidate, collection_registry.invalidate],
+        on_resubscribe=[semantic_cache.invalidate_all, collection_registry.invalidate_all]
+    ))
+    return asyncio.gather(knowledge_base_listener, template_listener)
+
+
+async def stop_background_services(connection: AbstractRobustConnection, cache_listeners: asyncio.Future):
+    cache_listeners.cancel()
+    await publisher.close()
+    # Close the RabbitMQ connection gracefully on shutdown
+    await connection.close()
+    logging.info("[*] Connection to RabbitMQ closed")
+    await reply_writer.close()
+    await mongodb_service.close_connection()
+    logging.info("[*] Connection to mongodb closed")
+    await http_client.aclose()
@@ -0,0 +1,145 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAnswer:
+    def __init__(self, query: str, language: str, embedding: np.ndarray, answer: str):
+        self.query = query
+        self.language = language
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = time.monotonic()
+
+
+class TenantAnswerCache:
+    """LRU-ordered answers for one tenant, with a lazily stacked embedding matrix for similarity search."""
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self.generation = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._keys = []
+
+    def matrix(self):
+        if self._matrix is None:
+            self._keys = list(self.entries.keys())
+            self._matrix = np.stack([self.entries[key].embedding for key in self._keys])
+        return self._keys, self._matrix
+
+    def changed(self):
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """
+    Per-tenant cache of final RAG answers, looked up by cosine similarity of the query embedding.
+
+    Entries expire after ttl seconds, each tenant keeps at most max_entries (least recently
+    used evicted first), and a tenant's entries are dropped whenever its knowledge base changes.
+    """
+
+    def __init__(self, threshold: float, ttl: int, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._tenants: Dict[str, TenantAnswerCache] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def generation(self, tenant_id: str) -> int:
+        tenant_cache = self._tenants.get(tenant_id)
+        return tenant_cache.generation if tenant_cache else 0
+
+    def _expire(self, tenant_cache: TenantAnswerCache):
+        now = time.monotonic()
+        expired = [key for key, entry in tenant_cache.entries.items() if now - entry.created_at > self.ttl]
+        for key in expired:
+            del tenant_cache.entries[key]
+        if expired:
+            tenant_cache.changed()
+
+    def lookup(self, tenant_id: str, embedding, language: str) -> Optional[str]:
+        """
+        Returns the cached answer of the most similar prior query, if it passes the threshold.
+        """
+        tenant_cache = self._tenants.get(tenant_id)
+        if tenant_cache:
+            self._expire(tenant_cache)
+        if not tenant_cache or not tenant_cache.entries:
+            self.misses += 1
+            return None
+
+        keys, matrix = tenant_cache.matrix()
+        similarities = matrix @ self._normalize(embedding)
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.threshold:
+                break
+            entry = tenant_cache.entries[keys[index]]
+            if entry.language != language:
+                continue
+            tenant_cache.entries.move_to_end(keys[index])
+            self.hits += 1
+            logger.info(f"Semantic cache hit for tenant {tenant_id} "
+                        f"(similarity {similarities[index]:.3f} to '{entry.query}')")
+            return entry.answer
+
+        self.misses += 1
+        return None
+
+    def store(self, tenant_id: str, query: str, embedding, language: str, answer: str, generation: int):
+        """
+        Caches an answer. Skipped if the tenant's knowledge base changed since the answer's lookup began.
+        """
+        tenant_cache = self._tenants.setdefault(tenant_id, TenantAnswerCache())
+        if tenant_cache.generation != generation:
+            return
+
+        key = self._key(query)
+        tenant_cache.entries[key] = CachedAnswer(query, language, self._normalize(embedding), answer)
+        tenant_cache.entries.move_to_end(key)
+        while len(tenant_cache.entries) > self.max_entries:
+            tenant_cache.entries.popitem(last=False)
+        tenant_cache.changed()
+
+    def invalidate(self, tenant_id: str):
+        tenant_cache = self._tenants.setdefault(tenant_id, TenantAnswerCache())
+        tenant_cache.entries.clear()
+        tenant_cache.generation += 1
+        tenant_cache.changed()
+        logger.info(f"Semantic cache invalidated for tenant {tenant_id}")
+
+    def invalidate_all(self):
+        """
+        Drops every tenant's answers, e.g. when change announcements may have been missed.
+        Answers still being generated are not stored afterwards, as their generation no longer matches.
+        """
+        for tenant_cache in list(self._tenants.values()):
+            tenant_cache.entries.clear()
+            tenant_cache.generation += 1
+            tenant_cache.changed()
+        logger.info("Semantic cache invalidated for all tenants")
+
+
+semantic_cache = SemanticAnswerCache(
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT
+)
@@ -1,16 +1,38 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
+import time
+from typing import List, Optional
 from app.core.config import settings
 from app.models.tenant_prompt_model import TenantPromptTemplate as TemplateModel
 from app.schemas.tenant_prompt_schema import TenantPromptTemplateCreate
-from openai import OpenAI
-from pymilvus import Collection
+from app.core.adaptive_limiter import embedding_limiter
+from app.core.concurrency import run_blocking
+from app.core.metrics import EMBEDDING_LATENCY, MILVUS_SEARCH_LATENCY, STAGE_ERRORS
+from app.core.redis_client import redis_client
+from app.core.token_budget import token_budget
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_coalescer import EmbeddingCoalescer
+from app.services.prompt_template_cache import prompt_templates
+from app.vector_db.collection_registry import collection_registry
+from openai import AsyncOpenAI
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+embedding_coalescer = EmbeddingCoalescer(
+    client,
+    model=settings.EMBEDDING_MODEL,
+    max_batch=settings.EMBEDDING_BATCH_MAX_INPUTS,
+    window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+    budget=token_budget,
+    limiter=embedding_limiter
+)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_template(db: Session, data: TenantPromptTemplateCreate):
+# Template type used for customer replies
+RAG_TEMPLATE_TYPE = "rag"
+
+async def create_template(db: AsyncSession, data: TenantPromptTemplateCreate):
     db_template = TemplateModel(
         tenant_id=data.tenant_id,
         prompt_template=data.prompt_template,
@@ -19,56 +41,162 @@ def create_template(db: Session, data: TenantPromptTemplateCreate):
         description=data.description
     )
     db.add(db_template)
-    db.commit()
-    db.refresh(db_template)
+    await db.commit()
+    await db.refresh(db_template)
+    await notify_template_changed(data.tenant_id)
+    return db_template
+
+async def update_template(db: AsyncSession, template_id: int, data: TenantPromptTemplateCreate):
+    db_template = await get_template_by_id(db, template_id)
+    if db_template is None:
+        return None
+    previous_tenant_id = db_template.tenant_id
+    for field, value in data.dict().items():
+        setattr(db_template, field, value)
+    await db.commit()
+    await db.refresh(db_template)
+    await notify_template_changed(data.tenant_id)
+    if previous_tenant_id != data.tenant_id:
+        await notify_template_changed(previous_tenant_id)
     return db_template
 
-def get_templates(db: Session, tenant_id: int = None):
-    query = db.query(TemplateModel)
+async def get_templates(db: AsyncSession, tenant_id: str = None):
+    query = select(TemplateModel)
     if tenant_id:
-        query = query.filter(TemplateModel.tenant_id == tenant_id)
-    return query.all()
+        query = query.where(TemplateModel.tenant_id == tenant_id)
+    result = await db.execute(query)
+    return result.scalars().all()
 
-def get_template_by_id(db: Session, template_id: int):
-    return db.query(TemplateModel).filter(TemplateModel.template_id == template_id).first()
+async def get_template_by_id(db: AsyncSession, template_id: int):
+    result = await db.execute(select(TemplateModel).where(TemplateModel.template_id == template_id))
+    return result.scalar_one_or_none()
 
-def embed_query(query_string: str) -> list:
-    # Use OpenAI API to generate embeddings for the query
-    response = client.embeddings.create(model=settings.EMBEDDING_MODEL,
-                                        input=query_string)
-    return response.data[0].embedding
+async def get_rag_template(db: AsyncSession, tenant_id: str):
+    """
+    Returns the tenant's most recent RAG template, or None if the tenant has none.
+    """
+    result = await db.execute(
+        select(TemplateModel)
+        .where(TemplateModel.tenant_id == tenant_id, TemplateModel.type == RAG_TEMPLATE_TYPE)
+        .order_by(TemplateModel.template_id.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
 
-def search_vectors_in_tenant_db(query_string: str, tenant_id: str) -> list:
+async def notify_template_changed(tenant_id: str):
+    """
+    Drops the tenant's cached template here and announces the change to the other processes.
+    """
+    prompt_templates.invalidate(tenant_id)
     try:
-        # Step 1: Generate embedding for the query
-        query_embedding = embed_query(query_string)
-        logger.info(f"Generated embedding for query: {query_string}")
-
-        # Step 2: Define search parameters with cosine similarity
-        search_params = {
-            "metric_type": "COSINE",
-            "M": 48,
-            "params": {"nprobe": 10}
-        }
-        logger.info(f"Search parameters: {search_params}")
-
-        # Step 3: Perform the search, explicitly requesting the "content" field in the output
-        collection = Collection(tenant_id)
-        logger.info(f"Searching in collection for tenant: {tenant_id}")
-        results = collection.search(
-            data=[query_embedding],  # Embedding of the query
+        await redis_client.publish(settings.PROMPT_TEMPLATE_UPDATES_CHANNEL, tenant_id)
+    except Exception as e:
+        logger.error(f"Failed to publish prompt template change for tenant {tenant_id}: {e}")
+
+async def embed_query(query_string: str) -> list:
+    # Repeated messages ("hi", quick replies) are served from the embedding cache
+    if settings.EMBEDDING_CACHE_ENABLED:
+        cached = await embedding_cache.get(query_string)
+        if cached is not None:
+            return cached
+
+    # Use OpenAI API to generate embeddings for the query, batched with concurrent queries
+    with EMBEDDING_LATENCY.time():
+        embedding = await embedding_coalescer.embed(query_string)
+
+    if settings.EMBEDDING_CACHE_ENABLED:
+        await embedding_cache.set(query_string, embedding)
+    return embedding
+
+async def embed_queries(query_strings: List[str], tenant_id: Optional[str] = None) -> List[list]:
+    """
+    Embeds many queries with a single embeddings call; cached and repeated queries are not sent.
+    The call is charged to tenant_id's token budget when given.
+    """
+    embeddings = {}
+    if settings.EMBEDDING_CACHE_ENABLED:
+        for query_string in set(query_strings):
+            cached = await embedding_cache.get(query_string)
+            if cached is not None:
+                embeddings[query_string] = cached
+
+    missing = [query_string for query_string in dict.fromkeys(query_strings) if query_string not in embeddings]
+    if missing:
+        async with token_budget.reserve(tenant_id, token_budget.count_tokens(missing)) as reservation:
+            with EMBEDDING_LATENCY.time():
+                async with embedding_limiter.slot():
+                    response = await client.embeddings.create(model=settings.EMBEDDING_MODEL, input=missing)
+            reservation.settle(response.usage)
+        for item in response.data:
+            embeddings[missing[item.index]] = item.embedding
+            if settings.EMBEDDING_CACHE_ENABLED:
+                await embedding_cache.set(missing[item.index], item.embedding)
+
+    return [embeddings[query_string] for query_string in query_strings]
+
+def _search_collection(tenant_id: str, query_embedding: list) -> list:
+    """
+    Blocking Milvus search, executed on the shared executor by search_vectors_by_embedding.
+    """
+    return _search_collection_many(tenant_id, [query_embedding])[0]
+
+def _search_collection_many(tenant_id: str, query_embeddings: List[list]) -> List[list]:
+    """
+    Blocking multi-vector Milvus search: one request, one list of contents per query embedding.
+    """
+    # Define search parameters with cosine similarity
+    search_params = {
+        "metric_type": "COSINE",
+        "M": 48,
+        "params": {"nprobe": 10}
+    }
+    logger.info(f"Search parameters: {search_params}")
+
+    # Perform the search, explicitly requesting the "content" field in the output
+    logger.info(f"Searching in collection for tenant: {tenant_id}")
+    started = time.perf_counter()
+    try:
+        results = collection_registry.get(tenant_id).search(
+            data=query_embeddings,   # Embeddings of the queries
             anns_field="embedding",  # Field where vector embeddings are stored
             param=search_params,     # Search parameters using cosine similarity
             limit=5,                 # Limit the number of results
             output_fields=["content"]
         )
+    except Exception as e:
+        # The cached handle may be outdated (collection dropped, released or re-indexed): rebuild once
+        logger.warning(f"Search on cached collection handle failed, refreshing: {e}")
+        collection_registry.discard(tenant_id)
+        results = collection_registry.get(tenant_id).search(
+            data=query_embeddings,
+            anns_field="embedding",
+            param=search_params,
+            limit=5,
+            output_fields=["content"]
+        )
+    elapsed = time.perf_counter() - started
+    collection_registry.record_search(elapsed)
+    MILVUS_SEARCH_LATENCY.observe(elapsed)
+    logger.info(f"Milvus search for tenant {tenant_id} took {elapsed * 1000:.1f} ms")
+    return [[hit.entity.get("content") for hit in hits if hit.entity.get("content")] for hits in results]
 
-        # Step 4: Process search results
-        contents = [hit.entity.get("content") for hit in results[0] if hit.entity.get("content")]
+async def search_vectors_by_embedding(query_embedding: list, tenant_id: str) -> list:
+    try:
+        # Search off the event loop
+        contents = await run_blocking(_search_collection, tenant_id, query_embedding)
         logger.info(f"Search Results: {contents}")
         return contents
 
     except Exception as e:
         # Log the exception and return an empty list
         logger.error(f"An error occurred during the vector search: {e}")
+        STAGE_ERRORS.labels(stage="retrieval").inc()
         return []
+
+async def search_vectors_by_embeddings(query_embeddings: List[list], tenant_id: str) -> List[list]:
+    try:
+        return await run_blocking(_search_collection_many, tenant_id, query_embeddings)
+    except Exception as e:
+        logger.error(f"An error occurred during the vector search: {e}")
+        STAGE_ERRORS.labels(stage="retrieval").inc()
+        return [[] for _ in query_embeddings]
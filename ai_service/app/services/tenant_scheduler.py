@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TenantStats:
+    """Running queue statistics for a single tenant."""
+
+    def __init__(self):
+        self.enqueued = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def to_dict(self, depth: int) -> dict:
+        return {
+            "queue_depth": depth,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "avg_wait_seconds": self.total_wait / self.dispatched if self.dispatched else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+class TenantFairScheduler:
+    """
+    Dispatches queued work to a fixed pool of workers, taking turns between tenants.
+
+    Each tenant has its own FIFO. Tenants with pending work sit in a ring and are
+    served weighted round-robin: a tenant with weight N gets up to N dispatches
+    before the ring moves on, so one tenant flooding the queue cannot starve the rest.
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], concurrency: int,
+                 weights: Optional[Dict[str, int]] = None, default_weight: int = 1):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.default_weight = default_weight
+
+        self._queues: Dict[str, Deque[Tuple[float, Any]]] = {}
+        self._ring: Deque[str] = deque()
+        self._credits: Dict[str, int] = {}
+        self._stats: Dict[str, TenantStats] = {}
+        self._available = asyncio.Semaphore(0)
+        self._workers = []
+        self.in_flight = 0
+
+    def _weight(self, tenant_id: str) -> int:
+        return max(1, self.weights.get(tenant_id, self.default_weight))
+
+    async def start(self):
+        for i in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"ai-worker-{i}"))
+        logger.info(f"[*] Started {self.concurrency} AI workers")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def submit(self, tenant_id: str, item: Any):
+        """
+        Queues an item for the given tenant. Never blocks; the broker prefetch bounds the backlog.
+        """
+        queue = self._queues.setdefault(tenant_id, deque())
+        if tenant_id not in self._credits:
+            self._ring.append(tenant_id)
+            self._credits[tenant_id] = self._weight(tenant_id)
+        queue.append((time.monotonic(), item))
+        self._stats.setdefault(tenant_id, TenantStats()).enqueued += 1
+        self._available.release()
+
+    def _next(self) -> Tuple[str, float, Any]:
+        tenant_id = self._ring[0]
+        queue = self._queues[tenant_id]
+        enqueued_at, item = queue.popleft()
+        self._credits[tenant_id] -= 1
+
+        if not queue:
+            # Tenant drained: leave the ring until it has work again
+            self._ring.popleft()
+            del self._credits[tenant_id]
+            del self._queues[tenant_id]
+        elif self._credits[tenant_id] <= 0:
+            # Turn used up: move to the back of the ring with a fresh allowance
+            self._ring.rotate(-1)
+            self._credits[tenant_id] = self._weight(tenant_id)
+
+        return tenant_id, enqueued_at, item
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            tenant_id, enqueued_at, item = self._next()
+            self._stats[tenant_id].record_wait(time.monotonic() - enqueued_at)
+
+            self.in_flight += 1
+            try:
+                await self.handler(item)
+            except Exception as e:
+                logger.error(f"[!] Worker failed on message for tenant {tenant_id}: {e}")
+            finally:
+                self.in_flight -= 1
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued(),
+            "tenants": {
+                tenant_id: tenant_stats.to_dict(len(self._queues.get(tenant_id, ())))
+                for tenant_id, tenant_stats in self._stats.items()
+            },
+        }
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from pymilvus import Collection, utility
+from pymilvus.client.types import LoadState
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionHandle:
+    def __init__(self, collection: Collection, signature: tuple):
+        self.collection = collection
+        self.signature = signature
+        self.loaded = False
+        self.stale = False
+        self.refreshed_at = time.monotonic()
+        self.last_used = self.refreshed_at
+
+
+class CollectionRegistry:
+    """
+    Process-wide cache of Milvus collection handles and their load state.
+
+    Building a Collection costs a describe-collection RPC, so handles are reused across
+    searches. A collection is loaded on first use, its handle is rebuilt when the schema or
+    index changes (checked every refresh_interval seconds, or right away after invalidate()),
+    and handles unused for idle_ttl seconds are dropped.
+
+    All methods are blocking and meant to run on the shared executor.
+    """
+
+    def __init__(self, idle_ttl: int, refresh_interval: int, latency_window: int = 1000):
+        self.idle_ttl = idle_ttl
+        self.refresh_interval = refresh_interval
+        self._handles: Dict[str, CollectionHandle] = {}
+        self._lock = threading.Lock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+        self._latencies = deque(maxlen=latency_window)
+
+    @staticmethod
+    def _signature(collection: Collection) -> tuple:
+        fields = tuple((field.name, field.dtype, field.params.get("dim")) for field in collection.schema.fields)
+        indexes = tuple(sorted((index.field_name, str(index.params)) for index in collection.indexes))
+        return fields, indexes
+
+    def _name_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def _ensure_loaded(self, handle: CollectionHandle):
+        if handle.loaded:
+            return
+        if utility.load_state(handle.collection.name) != LoadState.Loaded:
+            logger.info(f"Loading Milvus collection {handle.collection.name}")
+            handle.collection.load()
+        handle.loaded = True
+
+    def get(self, name: str) -> Collection:
+        """
+        Returns a loaded handle for the named collection.
+        """
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        handle: Optional[CollectionHandle] = self._handles.get(name)
+        if handle and not handle.stale and now - handle.refreshed_at < self.refresh_interval and handle.loaded:
+            handle.last_used = now
+            return handle.collection
+
+        with self._name_lock(name):
+            handle = self._handles.get(name)
+            if handle is None or handle.stale or now - handle.refreshed_at >= self.refresh_interval:
+                collection = Collection(name)
+                signature = self._signature(collection)
+                if handle is None or handle.signature != signature:
+                    if handle is not None:
+                        logger.info(f"Schema or index of collection {name} changed, refreshing handle")
+                    handle = CollectionHandle(collection, signature)
+                    self._handles[name] = handle
+                else:
+                    handle.stale = False
+                    handle.refreshed_at = now
+                    handle.loaded = False  # re-check load state with the refresh
+
+            self._ensure_loaded(handle)
+            handle.last_used = now
+            return handle.collection
+
+    def invalidate(self, name: str):
+        """
+        Forces a schema/index/load-state check on the next use of the collection.
+        """
+        handle = self._handles.get(name)
+        if handle:
+            handle.stale = True
+
+    def invalidate_all(self):
+        for handle in list(self._handles.values()):
+            handle.stale = True
+
+    def discard(self, name: str):
+        with self._lock:
+            self._handles.pop(name, None)
+
+    def _evict_idle(self, now: float):
+        idle = [name for name, handle in list(self._handles.items()) if now - handle.last_used > self.idle_ttl]
+        if idle:
+            with self._lock:
+                for name in idle:
+                    self._handles.pop(name, None)
+            logger.info(f"Evicted idle Milvus collection handles: {idle}")
+
+    def record_search(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            "handles": len(self._handles),
+            "loaded": sum(1 for handle in list(self._handles.values()) if handle.loaded),
+            "searches": len(latencies),
+            "search_latency_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)},
+        }
+
+
+collection_registry = CollectionRegistry(
+    idle_ttl=settings.MILVUS_HANDLE_IDLE_SECONDS,
+    refresh_interval=settings.MILVUS_HANDLE_REFRESH_SECONDS
+)
@@ -0,0 +1,121 @@
+"""
+Standalone AI message consumer, so consumer replicas can be sized apart from the HTTP API.
+
+    python -m app.worker --processes 4 --concurrency 8
+
+Each process runs one AIMessageConsumer with its own RabbitMQ connection and serves
+GET /health (and /metrics) on --health-port plus its index. On SIGTERM or SIGINT a process
+stops taking deliveries, finishes what it has in flight and shuts down.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def serve_health(consumer, port: int) -> asyncio.AbstractServer:
+    """
+    Minimal HTTP server: /metrics returns Prometheus metrics, anything else the consumer's
+    health (503 while draining).
+    """
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # skip headers
+
+            path = request_line.decode(errors="replace").split(" ")[1] if request_line.count(b" ") >= 2 else "/"
+            if path == "/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE_LATEST, generate_latest()
+            else:
+                health = {**consumer.health(), "pid": os.getpid()}
+                status = "200 OK" if health["status"] == "ok" else "503 Service Unavailable"
+                content_type, body = "application/json", json.dumps(health).encode()
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)
+
+
+async def run_worker(concurrency: int, health_port: Optional[int], drain_timeout: float):
+    # Imported here so the supervising process does not open Milvus/Mongo/Redis clients itself
+    from app.services.ai_consumer import AIMessageConsumer
+    from app.services.runtime import connect_rabbitmq, start_background_services, stop_background_services
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    connection = await connect_rabbitmq()
+    cache_listeners = await start_background_services(connection)
+    consumer = AIMessageConsumer(concurrency=concurrency)
+    health_server = await serve_health(consumer, health_port) if health_port else None
+    try:
+        await consumer.start(connection)
+        await stop.wait()
+        await consumer.drain(drain_timeout)
+    finally:
+        await consumer.stop()
+        if health_server:
+            health_server.close()
+        await stop_background_services(connection, cache_listeners)
+        logger.info(f"[*] Worker {os.getpid()} stopped")
+
+
+def run_process(index: int, concurrency: int, health_port: Optional[int], drain_timeout: float):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(concurrency, health_port + index if health_port else None, drain_timeout))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run AI_MESSAGE_QUEUE consumers without the HTTP API.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of consumer processes")
+    parser.add_argument("--concurrency", type=int, default=settings.AI_CONSUMER_CONCURRENCY,
+                        help="Concurrent messages per process")
+    parser.add_argument("--health-port", type=int, default=settings.WORKER_HEALTH_PORT,
+                        help="Health port of the first process (0 to disable)")
+    parser.add_argument("--drain-timeout", type=float, default=settings.WORKER_DRAIN_TIMEOUT_SECONDS,
+                        help="Seconds to wait for in-flight messages on shutdown")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process(0, args.concurrency, args.health_port, args.drain_timeout)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_process, name=f"ai-worker-{index}",
+                        args=(index, args.concurrency, args.health_port, args.drain_timeout))
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,56 @@
-import time
+import asyncio
 import json
 import logging
-from datetime import datetime, timezone
 
-import aioredis
-from fastapi import FastAPI, HTTPException
-from aio_pika import connect_robust, Message, DeliveryMode
-from aio_pika.abc import AbstractIncomingMessage
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel, constr, Field
-from typing import Optional
+from typing import List, Optional
 
 from starlette.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
 from app.api.v1.tenant_prompts import router as tenant_prompt_router
 from app.api.v1.rag import router as rag_router, input_token_price, output_token_price
+from app.core.adaptive_limiter import chat_limiters, embedding_limiter
 from app.core.database import engine, Base
+from app.core.metrics import record_token_usage
 from app.schemas.ai_reply import AIReply
-from app.schemas.chat_message import ChatMessage, MessageType, SourceType
-from app.services.mongodb_service import mongodb_service
-from app.services.llm_service import rag_pipeline, summarize
+from app.vector_db.collection_registry import collection_registry
+from app.services.ai_consumer import AIMessageConsumer
+from app.services.consumer_stats import consumer_stats
+from app.services.mongodb_service import reply_writer
+from app.services.llm_service import summarize, summarize_window
+from app.services.embedding_cache import embedding_cache
+from app.services.redis_service import chat_history
+from app.services.runtime import connect_rabbitmq, start_background_services, stop_background_services
+from app.services.semantic_cache import semantic_cache
 from contextlib import asynccontextmanager
-from app.core.prompt import RAG_PROMPT_TEMPLATE, SUMMARY_PROMPT_TEMPLATE
-
-RABBITMQ_HOST = settings.RABBITMQ_HOST
-RABBITMQ_PORT = settings.RABBITMQ_PORT
-RABBITMQ_USERNAME = settings.RABBITMQ_USERNAME
-RABBITMQ_PASSWORD = settings.RABBITMQ_PASSWORD
-TOPIC_EXCHANGE_NAME = settings.TOPIC_EXCHANGE_NAME
-SESSION_QUEUE_TEMPLATE = settings.SESSION_QUEUE_TEMPLATE
-AGENT_QUEUE_TEMPLATE = settings.AGENT_QUEUE_TEMPLATE
-AI_MESSAGE_QUEUE = settings.AI_MESSAGE_QUEUE
-RAG_PROMPT_TEMPLATE = RAG_PROMPT_TEMPLATE
-
-# In-memory store for received messages (for prototype)
-received_messages = []
-
-
-REDIS_HOST = settings.REDIS_HOST
-REDIS_PASSWORD =  settings.REDIS_PASSWORD
-REDIS_PORT = settings.REDIS_PORT
-# Initialize Redis client (ensure this is done once, e.g., at startup)
-redis_url = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}"
-redis_client = aioredis.from_url(redis_url, encoding="utf-8", decode_responses=True)
-
-class ReceivedMessage(BaseModel):
-    session_id: Optional[str] = None
-    sender: str
-    content: Optional[str] = None
-    type: str
-    tenant_id: str
-    user_type: Optional[str] = None
-    receiver: Optional[str] = None
+from app.core.prompt import SUMMARY_PROMPT_TEMPLATE
+
+# Consumer of AI_MESSAGE_QUEUE; only started here when RUN_CONSUMER_IN_API is set,
+# otherwise consumers run as separate `python -m app.worker` replicas
+consumer = AIMessageConsumer(concurrency=settings.AI_CONSUMER_CONCURRENCY)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    try:
-        # Establish robust connection to RabbitMQ
-        connection = await connect_robust(
-            host=RABBITMQ_HOST,
-            port=RABBITMQ_PORT,
-            login=RABBITMQ_USERNAME,
-            password=RABBITMQ_PASSWORD,
-        )
-
-        # Create a channel
-        channel = await connection.channel()
-
-        # Store the connection and channel in the FastAPI app state
-        app.state.connection = connection
-        app.state.channel = channel
-
-        # Declare or get the queue
-        queue = await channel.declare_queue(AI_MESSAGE_QUEUE, durable=True)
-
-        # Start consuming messages from the AI queue
-        await queue.consume(on_message_received)
-        logging.info(f"[*] Started consuming from queue: {AI_MESSAGE_QUEUE}")
+    # Create the tables in the database
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
+    connection = await connect_rabbitmq()
+    app.state.connection = connection
+    app.state.cache_listeners = await start_background_services(connection)
+    try:
+        if settings.RUN_CONSUMER_IN_API:
+            await consumer.start(connection)
         yield
     finally:
-        # Close the RabbitMQ connection gracefully on shutdown
-        await app.state.connection.close()
-        logging.info("[*] Connection to RabbitMQ closed")
-        await mongodb_service.close_connection()
-        logging.info("[*] Connection to mongodb closed")
+        await consumer.drain(settings.WORKER_DRAIN_TIMEOUT_SECONDS)
+        await consumer.stop()
+        await stop_background_services(connection, app.state.cache_listeners)
 
 
 app = FastAPI(title="AI Service", lifespan=lifespan)
@@ -98,199 +63,95 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers (Authorization, Content-Type, etc.)
 )
 
-# Create the tables in the database
-Base.metadata.create_all(bind=engine)
-
 app.include_router(tenant_prompt_router, prefix="/api/v1/tenant_prompts", tags=["Tenant Prompts"])
 app.include_router(rag_router, prefix="/api/v1/rag", tags=["RAG"])
 
 
-async def on_message_received(message: AbstractIncomingMessage):
-    async with message.process():
-        try:
-            # Decode and parse the incoming message
-            msg_content = message.body.decode()
-            msg_json = json.loads(msg_content)
-            logging.info(f"[>] Received message: {msg_json}")
-
-            # Validate and store the message
-            received_msg = ReceivedMessage(**msg_json)
-            received_messages.append(received_msg)
-
-
-            # Send the AI reply
-            logging.info(f"[>] CHAT")
-            await reply_with_rag(received_msg)
-
-        except json.JSONDecodeError:
-            logging.error("[!] Failed to decode message")
-        except Exception as e:
-            logging.error(f"[!] Error processing message: {e}")
-
-async def reply_with_rag(received_msg: ReceivedMessage):
-    await send_acknowledgement_message(received_msg)
-    response = await send_reply_message(received_msg)
-
-    receiver = received_msg.sender
-    query = received_msg.content
-    tenant_id = received_msg.tenant_id
-
-    ai_reply = AIReply.from_openai_completion(receiver, query, response, tenant_id, input_token_price,
-                                              output_token_price)
-
-    await mongodb_service.ensure_index(received_msg.tenant_id)
-    await mongodb_service.save_ai_reply(ai_reply)
-
-    timestamp  = time.time()
-
-    # Create ChatMessage instance for the reply
-    chat_message = ChatMessage(
-        session_id=received_msg.session_id,
-        type=MessageType.CHAT,
-        content=response.choices[0].message.content,
-        sender="AI",
-        sender_name="AI",
-        receiver=received_msg.sender,
-        tenant_id=tenant_id,
-        timestamp=timestamp,
-        source=SourceType.AI,
-        user_type="agent",
-        customer_id=received_msg.sender
-    )
-
-    logging.info(f"[>] Chat message: {chat_message}")
-
-    # Serialize ChatMessage to JSON
-    chat_message_json = chat_message.to_json()
-
-    # Define Redis key following the Java service pattern
-    redis_key = f"tenant:{tenant_id}:chat:customer_messages:{received_msg.session_id}"
-
-    # Push the serialized message to Redis
-    await redis_client.rpush(redis_key, chat_message_json)
-    print(f"Saved message to Redis under key: {redis_key}")
+async def handle_summary_request(request):
+    try:
+        response = await summarize(request.tenant_id, SUMMARY_PROMPT_TEMPLATE, request.customer_id)
+        return response
+    except ValueError as ve:
+        logging.warning(f"No chat history found: {ve}")
+        raise HTTPException(status_code=404, detail=str(ve))
+    except Exception as exc:
+        logging.error(f"Error handling summary request: {exc}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
-async def publish_message_to_queue(received_msg: ReceivedMessage, message_type: str, content: str = ""):
+async def worker_snapshots() -> List[dict]:
     """
-    Helper method to publish a message to the user's queue.
-    This method handles message creation, queue declaration, and message publishing.
+    Stats of the consumers running as app.worker processes, as they last wrote them to Redis.
     """
-    current_timestamp = datetime.now(timezone.utc).isoformat()
-    reply_message = {
-        "session_id": received_msg.session_id,
-        "sender": "ai",
-        "content": content,
-        "type": message_type,
-        "tenant_id": received_msg.tenant_id,
-        "user_type": "AI",
-        "SourceType": "AI",
-        "receiver": received_msg.sender,
-        "timestamp": current_timestamp
-    }
-
-    # Determine the user queue name based on session ID
-    user_queue_name = SESSION_QUEUE_TEMPLATE.format(session_id=received_msg.session_id)
-    logging.info(f"Publishing message to default exchange with routing_key: {user_queue_name}")
-
-    # Ensure the user queue exists. If not, declare it.
-    user_queue = await app.state.channel.declare_queue(
-        user_queue_name, durable=True
-    )
-
-    # Publish the message to the default exchange
-    await app.state.channel.default_exchange.publish(
-        Message(
-            body=json.dumps(reply_message).encode(),
-            delivery_mode=DeliveryMode.PERSISTENT,
-        ),
-        routing_key=user_queue_name  # Routing key is the queue name
-    )
+    try:
+        return await consumer_stats.collect()
+    except Exception as e:
+        logging.error(f"Failed to read consumer stats: {e}")
+        raise HTTPException(status_code=503, detail="Consumer stats are unavailable")
 
-    logging.info(f"[<] Sent {message_type} message to user queue: {user_queue_name}")
+@app.get("/status", summary="Check if messages have been received")
+async def get_status():
+    if settings.RUN_CONSUMER_IN_API:
+        stats = consumer.received_messages.stats()
+    else:
+        snapshots = await worker_snapshots()
+        stats = {
+            "message_count": sum(snapshot["messages"]["message_count"] for snapshot in snapshots),
+            "last_received_at": max((snapshot["messages"]["last_received_at"] for snapshot in snapshots
+                                     if snapshot["messages"]["last_received_at"]), default=None),
+            "consumers": [{"consumer": snapshot["consumer"], **snapshot["health"]} for snapshot in snapshots],
+        }
+    if stats["message_count"]:
+        return {"status": "received", **stats}
+    else:
+        return {"status": "no messages received yet", **stats}
 
-async def publish_summary_to_queue(received_msg: ReceivedMessage, content: str = ""):
-    """
-    Helper method to publish a message to the user's queue.
-    This method handles message creation, queue declaration, and message publishing.
-    """
-    current_timestamp = datetime.now(timezone.utc).isoformat()
-    reply_message = {
-        "session_id": None,
-        "sender": "ai",
-        "content": content,
-        "type": "SUMMARY",
-        "tenant_id": received_msg.tenant_id,
-        "user_type": "AI",
-        "SourceType": "AI",
-        "receiver": received_msg.sender,
-        "timestamp": current_timestamp
-    }
 
-    # Determine the user queue name based on session ID
-    agent_queue_name = AGENT_QUEUE_TEMPLATE.format(tenant_id=received_msg.tenant_id)
-    logging.info(f"Publishing message to agent with routing_key: {agent_queue_name}")
+@app.get("/metrics", summary="Prometheus metrics")
+async def get_metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-    # Ensure the user queue exists. If not, declare it.
-    agent_queue = await app.state.channel.declare_queue(
-        agent_queue_name, durable=True
-    )
 
-    # Publish the message to the default exchange
-    await app.state.channel.default_exchange.publish(
-        Message(
-            body=json.dumps(reply_message).encode(),
-            delivery_mode=DeliveryMode.PERSISTENT,
-        ),
-        routing_key=agent_queue_name  # Routing key is the queue name
-    )
+@app.get("/consumer/stats", summary="Per-tenant queue depth and wait time of the AI consumer")
+async def get_consumer_stats():
+    if settings.RUN_CONSUMER_IN_API:
+        return consumer.scheduler.stats()
+    # One entry per app.worker process
+    return {"consumers": {snapshot["consumer"]: snapshot["scheduler"] for snapshot in await worker_snapshots()}}
 
-    logging.info(f"[<] Sent summary message to user queue: {agent_queue_name}")
 
+@app.get("/cache/stats", summary="Hit and miss counters of the embedding and answer caches")
+async def get_cache_stats():
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "semantic_cache": {"hits": semantic_cache.hits, "misses": semantic_cache.misses},
+    }
 
-async def send_reply_message(received_msg: ReceivedMessage):
-    """
-    Sends a reply message back to the customer with modified sender and SourceType.
-    Utilizes the default exchange for direct messaging to user queues.
-    """
-    response = rag_pipeline(received_msg.content, received_msg.tenant_id, RAG_PROMPT_TEMPLATE, received_msg.session_id, received_msg.sender)
 
-    if isinstance(response, str):
-        reply_content = response
-    else:
-        reply_content = response.choices[0].message.content
-    await publish_message_to_queue(received_msg, "CHAT", reply_content)
-    return response
+@app.get("/milvus/stats", summary="Cached collection handles and vector search latency")
+async def get_milvus_stats():
+    return collection_registry.stats()
 
-async def send_acknowledgement_message(received_msg: ReceivedMessage):
-    """
-    Sends an acknowledgement message back to the customer to notify AI processing state.
-    Utilizes the default exchange for direct messaging to user queues.
-    """
-    await publish_message_to_queue(received_msg, "ACKNOWLEDGEMENT")
 
-async def handle_summary_request(request):
-    try:
-        response = summarize(request.tenant_id, SUMMARY_PROMPT_TEMPLATE, request.customer_id)
-        return response
-    except ValueError as ve:
-        logging.warning(f"No chat history found: {ve}")
-        raise HTTPException(status_code=404, detail=str(ve))
-    except Exception as exc:
-        logging.error(f"Error handling summary request: {exc}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+@app.get("/llm/stats", summary="Adaptive concurrency limits and latency of OpenAI calls")
+async def get_llm_stats():
+    return {"chat": chat_limiters.stats(), "embeddings": embedding_limiter.stats()}
 
-@app.get("/status", summary="Check if messages have been received")
-async def get_status():
-    if received_messages:
-        return {"status": "received", "message_count": len(received_messages)}
-    else:
-        return {"status": "no messages received yet"}
 
-
-@app.get("/messages", summary="Retrieve all received messages")
-async def get_messages():
-    return received_messages
+@app.get("/messages", summary="Page through recently received messages")
+async def get_messages(
+        cursor: int = Query(0, ge=0, description="Sequence number of the last message already seen"),
+        limit: int = Query(50, ge=1, le=settings.MESSAGES_PAGE_MAX_LIMIT),
+        tenant_id: Optional[str] = None,
+        session_id: Optional[str] = None):
+    if not settings.RUN_CONSUMER_IN_API:
+        # The message log lives in the memory of the consuming process
+        raise HTTPException(
+            status_code=503,
+            detail="Received messages are only kept by the consumer process, which does not run in "
+                   "the API (RUN_CONSUMER_IN_API=false); see /status and /consumer/stats for worker stats"
+        )
+    return consumer.received_messages.page(cursor, limit, tenant_id=tenant_id, session_id=session_id)
 
 
 from pydantic import BaseModel, Field
@@ -324,8 +185,8 @@ async def get_summary(request: SummaryRequest):
     ai_reply = AIReply.from_openai_completion(receiver, query, response, tenant_id, input_token_price,
                                               output_token_price)
 
-    await mongodb_service.ensure_index(request.tenant_id)
-    await mongodb_service.save_ai_reply(ai_reply)
+    reply_writer.add(ai_reply)
+    record_token_usage(ai_reply)
 
     summary = response.choices[0].message.content
 
@@ -339,3 +200,57 @@ async def get_summary(request: SummaryRequest):
     return summary_data
 
 
+class SummaryBatchRequest(BaseModel):
+    items: List[SummaryRequest] = Field(..., min_length=1, max_length=settings.SUMMARY_BATCH_MAX_ITEMS)
+
+
+@app.post("/summary/batch", summary="Summarize many customers at once, streamed back as NDJSON")
+async def get_summary_batch(request: SummaryBatchRequest):
+    """
+    Fetches every history in one Redis pipeline, runs the summaries concurrently (at most
+    SUMMARY_BATCH_CONCURRENCY at a time) and streams one JSON line per customer as soon as its
+    summary is ready. Failures are reported per line with an error and status.
+    """
+    logging.info(f"[>] Request Summary Batch - {len(request.items)} customers")
+    windows = await chat_history.get_windows([(item.customer_id, item.tenant_id) for item in request.items],
+                                             with_summary=settings.SUMMARY_INCREMENTAL)
+    semaphore = asyncio.Semaphore(settings.SUMMARY_BATCH_CONCURRENCY)
+
+    async def summarize_item(item: SummaryRequest, window) -> dict:
+        result = {"tenant_id": item.tenant_id, "customer_id": item.customer_id}
+        try:
+            if window is None:
+                raise ValueError("Session ID not found for the provided user_id.")
+            async with semaphore:
+                response = await summarize_window(item.tenant_id, window, SUMMARY_PROMPT_TEMPLATE)
+            result["summary"] = response.choices[0].message.content
+            result["response"] = response
+        except ValueError as ve:
+            logging.warning(f"No chat history found: {ve}")
+            result.update(error=str(ve), status=404)
+        except Exception as exc:
+            logging.error(f"Error handling summary request: {exc}")
+            result.update(error="Internal Server Error", status=500)
+        return result
+
+    async def stream():
+        tasks = [asyncio.create_task(summarize_item(item, window)) for item, window in zip(request.items, windows)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                response = result.pop("response", None)
+                if response is not None:
+                    ai_reply = AIReply.from_openai_completion("AGENT", "", response, result["tenant_id"],
+                                                              input_token_price, output_token_price)
+                    reply_writer.add(ai_reply)
+                    record_token_usage(ai_reply)
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Write this batch's usage records together
+            await reply_writer.flush()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
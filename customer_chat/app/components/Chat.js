@@ -87,6 +87,22 @@ const Chat = ({ tenantId, userId, userName, jwt }) => {
     console.log("Received message:", message);
     if (message.type === "CHAT") {
       setMessages((prevMessages) => [...prevMessages, message]);
+    } else if (message.type === "CHAT_CHUNK" || message.type === "CHAT_END") {
+      // Streamed AI reply: grow the last AI message chunk by chunk, CHAT_END carries the full text
+      setMessages((prevMessages) => {
+        const last = prevMessages[prevMessages.length - 1];
+        if (last && last.streaming) {
+          const content = message.type === "CHAT_END" ? message.content : last.content + message.content;
+          return [
+            ...prevMessages.slice(0, -1),
+            { ...last, content, streaming: message.type === "CHAT_CHUNK" },
+          ];
+        }
+        return [
+          ...prevMessages,
+          { ...message, type: "CHAT", streaming: message.type === "CHAT_CHUNK" },
+        ];
+      });
     }
     setIsReplying(message.type === "ACKNOWLEDGEMENT");
   };
@@ -31,6 +31,12 @@ public class RabbitConfig {
         return new Queue("chunking_complete_notification_queue", true);  // true for durable queue
     }
 
+    @Bean
+    public Queue handoverQueue() {
+        // Handover requests published by the AI service
+        return new Queue("handover_requests", true);  // true for durable queue
+    }
+
     @Bean
     public Jackson2JsonMessageConverter jsonMessageConverter() {
         return new Jackson2JsonMessageConverter();
@@ -0,0 +1,35 @@
+package org.service.customer.service;
+
+import lombok.extern.slf4j.Slf4j;
+import org.service.customer.dto.chat.HandoverEvent;
+import org.service.customer.dto.chat.HandoverRequest;
+import org.springframework.amqp.rabbit.annotation.RabbitListener;
+import org.springframework.stereotype.Service;
+
+@Slf4j
+@Service
+public class HandoverService {
+
+    private final ChatService chatService;
+
+    public HandoverService(ChatService chatService) {
+        this.chatService = chatService;
+    }
+
+    @RabbitListener(queues = "#{handoverQueue.name}")
+    public void receiveHandover(final HandoverRequest request) {
+        if (request == null) {
+            log.error("Received null handover request!");
+            return;
+        }
+        log.info("Received handover request for session {} of tenant {}", request.getSessionId(), request.getTenantId());
+
+        HandoverEvent event = new HandoverEvent();
+        event.setCustomerId(request.getCustomerId());
+        event.setTenantId(request.getTenantId());
+        event.setSessionId(request.getSessionId());
+
+        // Same as the REST endpoint: only publish that the customer is waiting
+        chatService.publishCustomerWaiting(event);
+    }
+}
@@ -29,9 +29,21 @@ class Settings(BaseSettings):
     # Redis Configuration
     redis_host: str = os.getenv("REDIS_HOST")
     redis_password: str = os.getenv("REDIS_PASSWORD")
+    redis_port: int = int(os.getenv("REDIS_PORT", "6379"))
+    # Channel ai_service listens on to invalidate its per-tenant answer cache
+    knowledge_base_updates_channel: str = "knowledge_base_updates"
 
     # embedding model
     embedding_model: str = "text-embedding-3-small"
+    # Coalesce concurrent single-entry embedding requests into one API call
+    embedding_batch_max_inputs: int = 64
+    embedding_batch_window_ms: float = 5.0
+    # Token-per-minute budget shared with ai_service (same Redis keys): one bucket for the whole
+    # OpenAI key and one per tenant, so a bulk upload cannot starve other tenants' chats
+    token_budget_enabled: bool = True
+    token_budget_tokens_per_minute: int = 2_000_000
+    token_budget_tenant_tokens_per_minute: int = 400_000
+    token_budget_key_prefix: str = "openai:token_budget"
 
     # MongoDB
     MONGO_HOST: str = os.getenv('MONGO_HOST', 'localhost')
@@ -1,17 +1,21 @@
 # app/repository/vector_store.py
 
+import asyncio
 import json
 import logging
 from typing import List, Optional
 from asyncio import Lock
 from fastapi import HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
 from pymilvus.orm.types import CONSISTENCY_STRONG
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.core.config import settings
 from app.dependencies import SessionLocalAsync
+from app.services.embedding_coalescer import EmbeddingCoalescer
+from app.services.knowledge_base_events import notify_knowledge_base_changed
+from app.services.token_budget import token_budget
 from app.services.tenant_doc_service import TenantDocService
 from app.schemas.tenant_doc_schema import TenantDocCreateSchema, TenantDocUpdateSchema
 
@@ -20,7 +24,15 @@ class OpenAIEmbeddingService:
     """Service class for handling OpenAI embedding generation."""
     def __init__(self, api_key: str, model: str):
         self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
         self.model = model
+        self.coalescer = EmbeddingCoalescer(
+            self.async_client,
+            model=model,
+            max_batch=settings.embedding_batch_max_inputs,
+            window_ms=settings.embedding_batch_window_ms,
+            budget=token_budget
+        )
 
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Generate embeddings for a list of texts using OpenAI API."""
@@ -31,6 +43,32 @@ class OpenAIEmbeddingService:
         except Exception as e:
             raise RuntimeError(f"Failed to generate embeddings: {e}")
 
+    async def get_embeddings_async(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings, batching with other concurrent requests into shared API calls."""
+        try:
+            texts = [text.replace("\n", " ") for text in texts]
+            return list(await asyncio.gather(*(self.coalescer.embed(text) for text in texts)))
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate embeddings: {e}")
+
+    async def get_tenant_embeddings(self, tenant_id: str, texts: List[str], batch_size: int = 256) -> List[List[float]]:
+        """
+        Generate embeddings for a tenant's bulk ingestion, batch by batch within the tenant's token budget,
+        so a large upload is paced instead of running into the API's rate limits.
+        """
+        try:
+            texts = [text.replace("\n", " ") for text in texts]
+            embeddings = []
+            for start in range(0, len(texts), batch_size):
+                batch = texts[start:start + batch_size]
+                async with token_budget.reserve(tenant_id, token_budget.count_tokens(batch)) as reservation:
+                    response = await self.async_client.embeddings.create(input=batch, model=self.model)
+                    reservation.settle(response.usage)
+                embeddings.extend(data.embedding for data in response.data)
+            return embeddings
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate embeddings: {e}")
+
 class MilvusCollectionService:
     """Service class for handling Milvus collections."""
     def __init__(self, host: str, port: int):
@@ -154,11 +192,12 @@ class MilvusCollectionService:
             raise RuntimeError(f"Failed to delete entry with id {entry_id}: {e}")
 
     def update_entry_by_id(self, collection: Collection, entry_id: int, new_content: str,
-                           openai_service: OpenAIEmbeddingService):
-        """Update content and recalculate embedding by id."""
+                           openai_service: OpenAIEmbeddingService, new_embedding: Optional[List[float]] = None):
+        """Update content and recalculate embedding by id (unless the new embedding is supplied)."""
         try:
             # Generate new embedding for the updated content
-            new_embedding = openai_service.get_embeddings([new_content])[0]
+            if new_embedding is None:
+                new_embedding = openai_service.get_embeddings([new_content])[0]
 
             # Retrieve the existing entry to get the 'doc_name'
             results = collection.query(expr=f"id == {entry_id}", output_fields=["doc_name"])
@@ -201,7 +240,8 @@ class VectorStoreManager:
                 self.locks[entry_id] = Lock()
             return self.locks[entry_id]
 
-    def process_tenant_data(self, tenant_id: str, content: List[str], doc_name: str, collection_name_prefix: str = "tenant_"):
+    def process_tenant_data(self, tenant_id: str, content: List[str], doc_name: str, collection_name_prefix: str = "tenant_",
+                            embeddings: Optional[List[List[float]]] = None):
         """
         Processes tenant data (list of strings) and stores it in a tenant-specific Milvus collection.
 
@@ -210,13 +250,15 @@ class VectorStoreManager:
             content (List[str]): A list of strings (texts) for which embeddings will be generated.
             doc_name (str): The name of the document.
             collection_name_prefix (str): A prefix for the tenant-specific collection name.
+            embeddings (Optional[List[List[float]]]): Precomputed embeddings for content, if any.
         """
         # Validate content
         if not isinstance(content, list) or not content:
             raise ValueError("Content must be a non-empty list of strings.")
 
         # Generate embeddings for the provided content
-        embeddings = self.openai_service.get_embeddings(content)
+        if embeddings is None:
+            embeddings = self.openai_service.get_embeddings(content)
         logging.debug(
             f"Generated {len(embeddings)} embeddings with dimensions {len(embeddings[0]) if embeddings else 0}")
 
@@ -235,16 +277,16 @@ class VectorStoreManager:
         logging.debug("process_tenant_data:  creating index")
         self.milvus_service.create_index(collection)
 
+        notify_knowledge_base_changed(tenant_id)
+
 
-    def update_entry_by_id(self, tenant_id: str, entry_id: int, new_content: str):
+    def update_entry_by_id(self, tenant_id: str, entry_id: int, new_content: str,
+                           new_embedding: Optional[List[float]] = None):
         """Update an entry's content by id and recalculate embedding."""
         tenant_collection_name = tenant_id
         collection = self.milvus_service.create_collection(tenant_collection_name, self._define_schema(tenant_id))
-        self.milvus_service.update_entry_by_id(collection, entry_id, new_content, self.openai_service)
-
-        # This should be async
-        # Refactor this method to be async
-        pass  # Implement as needed
+        self.milvus_service.update_entry_by_id(collection, entry_id, new_content, self.openai_service, new_embedding)
+        notify_knowledge_base_changed(tenant_id)
 
     def get_entries_by_doc_name(self, tenant_id: str, doc_name: str) -> List[dict]:
         """Get a list of entries (content, id) by doc_name."""
@@ -282,6 +324,7 @@ class VectorStoreManager:
 
             # Delete the entry from Milvus
             self.milvus_service.delete_entry_by_id(collection, entry_id)
+            notify_knowledge_base_changed(tenant_id)
 
             # Update SQLAlchemy ORM database
             async with SessionLocalAsync() as db:
@@ -70,7 +70,8 @@ async def update_entry_by_id(
 
 ):
     try:
-        vector_store_manager.update_entry_by_id(tenantId, entryId, update_request.newContent)
+        new_embedding = (await openai_service.get_embeddings_async([update_request.newContent]))[0]
+        vector_store_manager.update_entry_by_id(tenantId, entryId, update_request.newContent, new_embedding)
         return {
             "tenantId": tenantId,
             "entryId": entryId,
@@ -150,10 +151,12 @@ async def add_entry(
                 await TenantDocService.create_tenant_doc(tenant_doc_data, session)
 
         # Process the tenant data by passing content as a list with a single entry
+        embeddings = await openai_service.get_embeddings_async([add_request.content])
         vector_store_manager.process_tenant_data(
             tenant_id=tenantId,
             content=[add_request.content],
-            doc_name=add_request.docName
+            doc_name=add_request.docName,
+            embeddings=embeddings
         )
         return {
             "tenantId": tenantId,
@@ -0,0 +1,76 @@
+# app/services/embedding_coalescer.py
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCoalescer:
+    """
+    Collects concurrent single-text embedding requests and sends them as one batched
+    embeddings.create(input=[...]) call.
+
+    A batch is sent once max_batch distinct texts are waiting, or window_ms after the first
+    one arrived, whichever comes first. Each caller gets back the vector for its own text.
+    With a token budget, every batch waits for its tokens in the global bucket before it is sent.
+    """
+
+    def __init__(self, client, model: str, max_batch: int = 64, window_ms: float = 5.0, budget=None):
+        self.client = client
+        self.budget = budget
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.inputs = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(text, []).append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: Dict[str, List[asyncio.Future]]):
+        texts = list(batch.keys())
+        try:
+            if self.budget is not None:
+                async with self.budget.reserve(None, self.budget.count_tokens(texts)) as reservation:
+                    response = await self.client.embeddings.create(model=self.model, input=texts)
+                    reservation.settle(response.usage)
+            else:
+                response = await self.client.embeddings.create(model=self.model, input=texts)
+            self.batches += 1
+            self.inputs += len(texts)
+            for item in response.data:
+                for future in batch[texts[item.index]]:
+                    if not future.done():
+                        future.set_result(item.embedding)
+        except Exception as e:
+            logger.error(f"Batched embedding request for {len(texts)} inputs failed: {e}")
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
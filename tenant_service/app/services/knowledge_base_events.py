@@ -0,0 +1,27 @@
+# app/services/knowledge_base_events.py
+
+import logging
+
+import redis
+
+from app.core.config import settings
+
+# Connections are opened lazily on first publish
+redis_client = redis.Redis(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    password=settings.redis_password,
+    decode_responses=True
+)
+
+
+def notify_knowledge_base_changed(tenant_id: str):
+    """
+    Announces that a tenant's knowledge base changed, so ai_service drops the tenant's cached answers.
+    A failed notification is logged but never fails the write itself.
+    """
+    try:
+        redis_client.publish(settings.knowledge_base_updates_channel, tenant_id)
+        logging.info(f"Published knowledge base change for tenant {tenant_id}")
+    except redis.RedisError as e:
+        logging.error(f"Failed to publish knowledge base change for tenant {tenant_id}: {e}")
@@ -56,7 +56,8 @@ async def process_file(file_path: str, tenant_id: str):
 
         number_of_entries = len(texts)  # Calculate the number of entries processed
         file_name = os.path.basename(file_path)
-        vector_store_manager.process_tenant_data(tenant_id, texts, file_name)
+        embeddings = await openai_service.get_tenant_embeddings(tenant_id, texts)
+        vector_store_manager.process_tenant_data(tenant_id, texts, file_name, embeddings=embeddings)
 
         logging.info(f"Processing completed for tenant {tenant_id}, file: {file_path}, entries processed: {number_of_entries}")
 
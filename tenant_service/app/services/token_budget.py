@@ -0,0 +1,180 @@
+# app/services/token_budget.py
+
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from typing import Iterable, List, Optional
+
+import redis.asyncio as aioredis
+import tiktoken
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Must stay in sync with ai_service/app/core/token_budget.py: both services draw from the same buckets,
+# and the two services are built and deployed separately, so the code is copied rather than shared.
+# Token buckets refilled continuously at capacity tokens per minute, stored as {tokens, ts} hashes.
+# KEYS: bucket keys; ARGV[1]: tokens requested, ARGV[1 + i]: capacity of KEYS[i]
+# Takes the tokens from every bucket and returns 0 if all of them can afford it, otherwise takes
+# nothing and returns the milliseconds until they can. Requests larger than a bucket only wait
+# for a full bucket and leave it in debt.
+ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local requested = tonumber(ARGV[1])
+
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i + 1])
+    local rate = capacity / 60000
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    local needed = math.min(requested, capacity)
+    if tokens < needed then
+        wait = math.max(wait, math.ceil((needed - tokens) / rate))
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - requested
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+    redis.call('PEXPIRE', key, 120000)
+end
+return wait
+"""
+
+# Gives back (or takes more of) the tokens of a settled call. KEYS: bucket keys; ARGV[1]: tokens to return
+SETTLE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HINCRBYFLOAT', key, 'tokens', ARGV[1])
+    end
+end
+return 0
+"""
+
+
+class TokenReservation:
+    """
+    Tokens taken from the budget for one API call. Call settle() with the usage reported by the
+    API; the difference to the estimate is given back to (or taken from) the buckets.
+    """
+
+    def __init__(self, tenant_id: Optional[str], estimate: int, waited: float = 0.0):
+        self.tenant_id = tenant_id
+        self.estimate = estimate
+        self.waited = waited
+        self.actual: Optional[int] = None
+
+    def settle(self, usage):
+        # Streams that ended without a usage chunk report zeros; keep the estimate then
+        if usage is not None and usage.total_tokens:
+            self.actual = usage.total_tokens
+
+
+class TokenBudget:
+    """
+    Token-per-minute limiter for OpenAI calls, sharing its Redis buckets with ai_service so the
+    limits hold for the whole API key. Callers wait for budget instead of failing; if Redis is
+    unreachable, calls go through unthrottled.
+    """
+
+    def __init__(self, client, tokens_per_minute: int, tenant_tokens_per_minute: int, key_prefix: str):
+        self.client = client
+        self.tokens_per_minute = tokens_per_minute
+        self.tenant_tokens_per_minute = tenant_tokens_per_minute
+        self.key_prefix = key_prefix
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        self._settle = client.register_script(SETTLE_SCRIPT)
+        self._encoding = None
+
+    def count_tokens(self, texts: Iterable[str]) -> int:
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        return sum(len(self._encoding.encode(text)) for text in texts)
+
+    def _keys(self, tenant_id: Optional[str]) -> List[str]:
+        keys = [f"{self.key_prefix}:global"]
+        if tenant_id:
+            keys.append(f"{self.key_prefix}:tenant:{tenant_id}")
+        return keys
+
+    def _capacities(self, tenant_id: Optional[str]) -> List[int]:
+        capacities = [self.tokens_per_minute]
+        if tenant_id:
+            capacities.append(self.tenant_tokens_per_minute)
+        return capacities
+
+    async def acquire(self, tenant_id: Optional[str], tokens: int) -> float:
+        """
+        Waits until the global and tenant buckets can afford tokens, then takes them.
+        Returns the seconds waited.
+        """
+        waited = 0.0
+        keys = self._keys(tenant_id)
+        args = [tokens, *self._capacities(tenant_id)]
+        while True:
+            try:
+                wait_ms = int(await self._acquire(keys=keys, args=args))
+            except Exception as e:
+                logger.error(f"Token budget unavailable, not throttling: {e}")
+                return waited
+            if wait_ms <= 0:
+                break
+            # Jitter so callers released by the same refill do not all retry at once
+            delay = wait_ms / 1000 * random.uniform(1.0, 1.2)
+            await asyncio.sleep(delay)
+            waited += delay
+        # No Prometheus in this service: the wait ai_service observes in TOKEN_BUDGET_WAIT is logged
+        if waited:
+            logger.info(f"Waited {waited:.2f}s for {tokens} tokens (tenant {tenant_id})")
+        return waited
+
+    async def release(self, tenant_id: Optional[str], tokens: int):
+        try:
+            await self._settle(keys=self._keys(tenant_id), args=[tokens])
+        except Exception as e:
+            logger.error(f"Failed to settle token budget: {e}")
+
+    @asynccontextmanager
+    async def reserve(self, tenant_id: Optional[str], estimate: int):
+        """
+        Acquires estimate tokens around an API call. On exit the reservation is reconciled
+        with the usage passed to settle(); a failed call gives all its tokens back. A cancelled
+        call keeps its estimate, as the request may already have been processed.
+        """
+        if not settings.token_budget_enabled:
+            yield TokenReservation(tenant_id, estimate)
+            return
+
+        waited = await self.acquire(tenant_id, estimate)
+        reservation = TokenReservation(tenant_id, estimate, waited)
+        try:
+            yield reservation
+        except Exception:
+            await self.release(tenant_id, estimate)
+            raise
+        if reservation.actual is not None and reservation.actual != estimate:
+            await self.release(tenant_id, estimate - reservation.actual)
+
+
+token_budget = TokenBudget(
+    aioredis.Redis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        password=settings.redis_password,
+        decode_responses=True
+    ),
+    tokens_per_minute=settings.token_budget_tokens_per_minute,
+    tenant_tokens_per_minute=settings.token_budget_tenant_tokens_per_minute,
+    key_prefix=settings.token_budget_key_prefix
+)